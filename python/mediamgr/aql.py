@@ -1,6 +1,8 @@
+from mediamgr.schema import media_metadata_fields
 from arango.cursor import Cursor
 from arango.database import Database
 from arango.result import Result
+from typing import Any, Iterator, List, Tuple
 
 def execute_saved_query(db: Database, query_name: str, **kwargs) -> Result[Cursor]:
     """Execute a saved query and return the cursor
@@ -23,6 +25,132 @@ def execute_saved_query(db: Database, query_name: str, **kwargs) -> Result[Curso
     return db.aql.execute(query, bind_vars=bv)
 
 
+class MediaQuery ():
+    """Index-backed query builder over the typed fields of media.metadata
+
+    Filters and sort order are restricted to the fields declared in
+    mediamgr.schema.media_metadata_fields, each of which has a persistent
+    index on [metadata.<field>, _key].  Results are paged by key range: each
+    page resumes after the (sort value, _key) of the previous page's last
+    document instead of using OFFSET.
+
+    A query uses only one of these indexes.  When every filter is on the sort
+    field (or there are no filters), that index serves both and each page
+    costs the same to fetch.  Filtering on one field and sorting by another,
+    as in the example below, walks the index of one of them and sorts the
+    remaining matches in full for every page, so the cost per page grows with
+    the number of matches; keep such result sets small.
+
+    Documents saved before media schema version 2 carry none of the typed
+    fields, so they never match a filter and sort before everything else.
+
+    Example:
+        q = MediaDocument(db).query().where('type', '==', 'video').where('duration', '>=', 600).order_by('duration')
+        docs, after = q.page()
+        while after is not None:
+            docs, after = q.page(after)
+    """
+
+    OPERATORS = ['==', '!=', '<', '<=', '>', '>=', 'IN', 'NOT IN']
+
+    def __init__ (self, db: Database, page_size: int = 100):
+        """Instantiate a media query
+
+        db          --  arango.database.Database instance
+        page_size   --  documents returned per page
+        """
+        self.db = db
+        self.page_size = page_size
+        self.filters = []       # (field, operator, value)
+        self.sort_field = None  # None sorts by _key alone
+        self.descending = False
+
+
+    def _field (self, field: str) -> str:
+        if field not in media_metadata_fields:
+            raise ValueError("'{}' is not an indexed media metadata field".format(field))
+        return field
+
+
+    def order_by (self, field: str, descending: bool = False) -> 'MediaQuery':
+        """Sort (and page) by an indexed metadata field, ties broken by _key"""
+        self.sort_field = self._field(field)
+        self.descending = descending
+        return self
+
+
+    def where (self, field: str, operator: str, value: Any) -> 'MediaQuery':
+        """Add a filter on an indexed metadata field
+
+        field       --  key of mediamgr.schema.media_metadata_fields
+        operator    --  one of MediaQuery.OPERATORS
+        value       --  comparison value (a list for IN / NOT IN)
+        """
+        if operator.upper() not in self.OPERATORS:
+            raise ValueError("unsupported operator '{}'".format(operator))
+        self.filters.append((self._field(field), operator.upper(), value))
+        return self
+
+
+    def build (self, after: Tuple[Any, str] = None) -> Tuple[str, dict]:
+        """Returns the AQL query and bind vars for one page
+
+        after   --  (sort value, _key) of the last document of the previous page
+        """
+        bv = {'page_size': self.page_size}
+        lines = ['FOR m IN media']
+        for i, (field, operator, value) in enumerate(self.filters):
+            lines.append('FILTER m.metadata.{} {} @value{}'.format(field, operator, i))
+            bv['value{}'.format(i)] = value
+
+        cmp = '<' if self.descending else '>'
+        direction = 'DESC' if self.descending else 'ASC'
+        if self.sort_field is None:
+            if after is not None:
+                lines.append('FILTER m._key {} @after_key'.format(cmp))
+                bv['after_key'] = after[1]
+            lines.append('SORT m._key {}'.format(direction))
+        else:
+            sort_attr = 'm.metadata.{}'.format(self.sort_field)
+            if after is not None:
+                lines.append('FILTER {0} {1} @after_value OR ({0} == @after_value AND m._key {1} @after_key)'.format(
+                    sort_attr, cmp))
+                bv['after_value'], bv['after_key'] = after
+            lines.append('SORT {0} {1}, m._key {1}'.format(sort_attr, direction))
+        lines.append('LIMIT @page_size')
+        lines.append('RETURN m')
+
+        return '\n'.join(lines), bv
+
+
+    def page (self, after: Tuple[Any, str] = None) -> Tuple[List[dict], Tuple[Any, str]]:
+        """Fetch one page of media documents
+
+        after   --  value returned as the second element by the previous call,
+                    None for the first page
+
+        Returns (documents, after) where after is None once there are no more pages
+        """
+        query, bv = self.build(after)
+        docs = list(self.db.aql.execute(query, bind_vars=bv, batch_size=self.page_size))
+        if len(docs) < self.page_size:
+            return docs, None
+
+        last = docs[-1]
+        value = last['metadata'].get(self.sort_field) if self.sort_field is not None else None
+        return docs, (value, last['_key'])
+
+
+    def __iter__ (self) -> Iterator[dict]:
+        """Iterate over every matching document, a page at a time"""
+        after = None
+        while True:
+            docs, after = self.page(after)
+            yield from docs
+            if after is None:
+                return
+
+
 saved_queries = {
     'cast_by_media': {
         'query': '''
@@ -0,0 +1,350 @@
+"""Integrity verification and garbage collection for the CAS directory
+
+The CAS directory (see cas/ingest.sh and mediamgr.pipeline.ingest) holds one
+hard link per distinct file, named <md5 of contents>.<ext>.  verify() rehashes
+objects in parallel at a bounded read rate and flags any whose contents no
+longer match their name.  Results are recorded in a local SQLite state file as
+they complete, so an interrupted run resumes where it stopped and objects
+verified recently (and unchanged since) are skipped.
+
+cross_reference() compares the object set against media.metadata.md5 in the
+db, listing orphaned objects (no media document) and dangling references
+(media documents whose object is missing).  Objects whose inode changed within
+a grace period (config.cas_grace_hours) are left out of the orphan list and
+never quarantined: ingest links an object into the CAS before the pipeline
+creates its media document, so a fresh object without one is usually in flight.
+
+Media documents created before metadata.md5 was a typed field may lack it.
+Those are matched to objects by _key (the pipeline keys media by content
+hash); while any remain unmatched, the object set cannot be fully accounted
+for and main() refuses to quarantine orphans.
+
+Usage:
+    python -m mediamgr.cas [--cas dir] [--state path] [--rate MB/s] [--recheck days]
+                           [--grace hours] [--quarantine dir] [--no-db]
+"""
+import mediamgr.config as config
+from mediamgr.localdb import sqlite_transaction
+from concurrent.futures import ThreadPoolExecutor
+import errno
+import hashlib
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Set
+
+
+log = logging.getLogger(__name__)
+
+OBJECT_NAME = re.compile(r'^([0-9a-f]{32})(\.[^/]*)?$')
+
+
+class RateLimiter ():
+    """Token bucket shared by all hashing threads, in bytes per second"""
+
+    def __init__ (self, rate: float, burst: float = None):
+        """Instantiate a rate limiter
+
+        rate    --  sustained bytes per second; None or 0 disables limiting
+        burst   --  bucket size in bytes, defaults to one second's worth
+        """
+        self.rate = rate
+        self.capacity = burst or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+
+    def consume (self, n: int):
+        """Block until n bytes may be read"""
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= n
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+def objects (cas_path: str) -> Dict[str, str]:
+    """Returns {filename: md5} for every well-formed object name in the CAS directory"""
+    result = {}
+    for name in os.listdir(cas_path):
+        match = OBJECT_NAME.match(name)
+        if match:
+            result[name] = match.group(1)
+    return result
+
+
+def hash_file (path: str, limiter: RateLimiter = None, blocksize: int = 1 << 20) -> str:
+    """Returns the hex md5 digest of a file, reading no faster than limiter allows"""
+    h = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            if limiter is not None:
+                limiter.consume(len(block))
+            h.update(block)
+    return h.hexdigest()
+
+
+class Verifier ():
+    """Rehashes CAS objects and records the results in a local state file"""
+
+    def __init__ (self, cas_path: str = None, state_path: str = None):
+        """Instantiate a verifier
+
+        cas_path    --  CAS directory, defaults to config.cas_path
+        state_path  --  SQLite state file, defaults to config.cas_state_path
+        """
+        self.cas_path = cas_path or config.cas_path
+        self.state_path = state_path or config.cas_state_path
+        self.conn = sqlite3.connect(self.state_path, isolation_level=None, timeout=30,
+                                    check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS verified (
+                name        TEXT PRIMARY KEY,
+                size        INTEGER NOT NULL,
+                mtime       REAL NOT NULL,
+                verified_at REAL NOT NULL,
+                ok          INTEGER NOT NULL,
+                actual      TEXT
+            ) WITHOUT ROWID;
+        ''')
+        self.lock = threading.Lock()
+
+
+    def close (self):
+        self.conn.close()
+
+
+    def corrupt (self) -> List[str]:
+        """Returns the names of objects whose last verification failed"""
+        return [ _[0] for _ in self.conn.execute('SELECT name FROM verified WHERE ok = 0 ORDER BY name') ]
+
+
+    def due (self, names: Iterable[str], recheck: float) -> List[str]:
+        """Returns the objects needing verification
+
+        names   --  object filenames to consider
+        recheck --  seconds after which a successful verification expires
+
+        An object is due if it was never verified, last failed, changed size or
+        mtime since, or was verified more than recheck seconds ago
+        """
+        known = { _[0]: _[1:] for _ in self.conn.execute('SELECT name, size, mtime, verified_at, ok FROM verified') }
+        cutoff = time.time() - recheck
+        result = []
+        for name in names:
+            try:
+                st = os.stat(os.path.join(self.cas_path, name))
+            except FileNotFoundError:
+                continue
+            state = known.get(name)
+            if state is None or not state[3] or state[2] < cutoff \
+                    or state[0] != st.st_size or state[1] != st.st_mtime:
+                result.append(name)
+        return result
+
+
+    def forget_missing (self, names: Set[str]) -> int:
+        """Drop state for objects no longer in the CAS directory"""
+        gone = [ (_[0],) for _ in self.conn.execute('SELECT name FROM verified') if _[0] not in names ]
+        with self.lock, sqlite_transaction(self.conn):
+            self.conn.executemany('DELETE FROM verified WHERE name = ?', gone)
+        return len(gone)
+
+
+    def _record (self, name: str, size: int, mtime: float, actual: str, ok: bool):
+        with self.lock, sqlite_transaction(self.conn):
+            self.conn.execute('INSERT OR REPLACE INTO verified VALUES (?, ?, ?, ?, ?, ?)',
+                              (name, size, mtime, time.time(), int(ok), actual))
+
+
+    def verify (self, recheck: float = 30 * 86400, rate: float = None, workers: int = 4) -> dict:
+        """Rehash every due object
+
+        recheck --  seconds a successful verification stays valid
+        rate    --  maximum total read rate in bytes per second (None: unlimited)
+        workers --  files hashed in parallel
+
+        Returns {'checked': n, 'skipped': n, 'corrupt': [names], 'errors': {name: message}}
+        """
+        names = objects(self.cas_path)
+        self.forget_missing(set(names))
+        due = self.due(names, recheck)
+        limiter = RateLimiter(rate)
+        errors = {}
+
+        def check (name):
+            path = os.path.join(self.cas_path, name)
+            try:
+                st = os.stat(path)
+                actual = hash_file(path, limiter)
+            except OSError as e:
+                errors[name] = str(e)
+                return
+            ok = actual == names[name]
+            if not ok:
+                log.warning("%s: contents hash to %s", name, actual)
+            self._record(name, st.st_size, st.st_mtime, actual, ok)
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(check, due))
+
+        return {
+            'checked': len(due) - len(errors),
+            'skipped': len(names) - len(due),
+            'corrupt': self.corrupt(),
+            'errors': errors
+        }
+
+
+def settled (path: str, grace: float) -> bool:
+    """True if path exists and its inode has not changed (st_ctime) for grace seconds"""
+    try:
+        return os.stat(path).st_ctime < time.time() - grace
+    except FileNotFoundError:
+        return False
+
+
+def cross_reference (db, cas_path: str = None, grace: float = None) -> dict:
+    """Compare the CAS object set with the media documents that reference it
+
+    db          --  db handle from mediamgr.connect()
+    cas_path    --  CAS directory, defaults to config.cas_path
+    grace       --  seconds; objects changed more recently are never reported
+                    as orphans, defaults to config.cas_grace_hours
+
+    Makes a single streaming pass over 'media'.  Documents without
+    metadata.md5 reference the object named by their _key, if there is one.
+    Returns {'orphans': [object names with no media document],
+             'dangling': [media _keys whose object is missing],
+             'unhashed': number of media documents without metadata.md5,
+             'unresolved': number of those whose _key names no object}
+    Orphans are only trustworthy while unresolved is 0
+    """
+    cas_path = cas_path or config.cas_path
+    grace = config.cas_grace_hours * 3600 if grace is None else grace
+    names = objects(cas_path)
+    md5s = set(names.values())
+
+    referenced = set()
+    dangling = []
+    unhashed = unresolved = 0
+    cursor = db.aql.execute('''
+        FOR m IN media
+            RETURN [m._key, m.metadata.md5]
+    ''', batch_size=10000, stream=True)
+    for key, md5 in cursor:
+        if md5 is None:
+            unhashed += 1
+            if key in md5s:
+                referenced.add(key)
+            else:
+                unresolved += 1     # may still own an object under another name
+            continue
+        referenced.add(md5)
+        if md5 not in md5s:
+            dangling.append(key)
+
+    return {
+        'orphans': sorted( n for n, md5 in names.items()
+                           if md5 not in referenced and settled(os.path.join(cas_path, n), grace) ),
+        'dangling': sorted(dangling),
+        'unhashed': unhashed,
+        'unresolved': unresolved
+    }
+
+
+def quarantine (names: Iterable[str], cas_path: str, quarantine_path: str, grace: float = None) -> int:
+    """Move objects out of the CAS directory for later inspection or removal
+
+    names           --  object filenames
+    cas_path        --  CAS directory
+    quarantine_path --  destination directory, may be on another filesystem
+    grace           --  seconds; objects changed more recently are left in
+                        place, defaults to config.cas_grace_hours
+
+    Objects are hard links, so this never removes the only copy of the
+    original source file (except across filesystems, where the object is
+    copied and then unlinked).  Returns the number of objects moved
+    """
+    grace = config.cas_grace_hours * 3600 if grace is None else grace
+    os.makedirs(quarantine_path, exist_ok=True)
+    moved = 0
+    for name in names:
+        src = os.path.join(cas_path, name)
+        dst = os.path.join(quarantine_path, name)
+        if not settled(src, grace):
+            continue
+        try:
+            try:
+                os.rename(src, dst)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                shutil.move(src, dst)
+            moved += 1
+        except FileNotFoundError:
+            pass
+    return moved
+
+
+def main (argv: List[str] = None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cas', default=config.cas_path, help='CAS directory')
+    parser.add_argument('--state', default=config.cas_state_path, help='verification state file')
+    parser.add_argument('--rate', type=float, default=config.cas_verify_rate,
+                        help='maximum read rate in MB/s (0 for unlimited)')
+    parser.add_argument('--recheck', type=float, default=config.cas_recheck_days,
+                        help='days before a verified object is hashed again')
+    parser.add_argument('--workers', type=int, default=4, help='files hashed in parallel')
+    parser.add_argument('--grace', type=float, default=config.cas_grace_hours,
+                        help='hours after a change before an object may be reported orphaned or quarantined')
+    parser.add_argument('--quarantine', help='move corrupt and orphaned objects into this directory')
+    parser.add_argument('--no-db', action='store_true', help='skip the media cross-reference')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+
+    verifier = Verifier(args.cas, args.state)
+    result = verifier.verify(recheck=args.recheck * 86400, rate=args.rate * (1 << 20), workers=args.workers)
+    log.info("verified %d objects, skipped %d recently verified", result['checked'], result['skipped'])
+    for name in result['corrupt']:
+        log.warning("corrupt: %s", name)
+    for name, error in result['errors'].items():
+        log.warning("unreadable: %s (%s)", name, error)
+
+    orphans = []
+    if not args.no_db:
+        from mediamgr.models import connect
+        refs = cross_reference(connect(), args.cas, args.grace * 3600)
+        orphans = refs['orphans']
+        for name in orphans:
+            log.warning("orphaned: %s", name)
+        for key in refs['dangling']:
+            log.warning("dangling: media/%s", key)
+        if refs['unhashed']:
+            log.warning("%d media documents have no metadata.md5, %d of them not matched to an object by _key",
+                        refs['unhashed'], refs['unresolved'])
+        if refs['unresolved'] and args.quarantine:
+            log.warning("not quarantining orphans while media documents are unresolved")
+            orphans = []
+
+    if args.quarantine:
+        moved = quarantine(result['corrupt'] + orphans, args.cas, args.quarantine, args.grace * 3600)
+        log.info("moved %d objects to %s", moved, args.quarantine)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+from arango.database import Database
+from arango.exceptions import AQLQueryExecuteError
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Iterator, List, Tuple
+
+
+SEQUENCE_KEY = 'changelog_seq'     # counter document in mmconfig
+CHECKPOINT_PREFIX = 'checkpoint_'  # consumer checkpoints in mmconfig
+SEQUENCE_FIELD = 'mm_seq'          # stamped onto every tracked document at save
+
+
+def next_sequence (db: Database, count: int = 1, retries: int = 10) -> int:
+    """Reserve a contiguous range of changelog sequence numbers
+
+    db      --  transaction db handle from transaction(); the reservation
+                then commits or rolls back with the writes it numbers
+    count   --  number of sequence numbers to reserve
+    retries --  attempts before giving up on write-write conflicts
+
+    Returns the first number of the reserved range; the range is
+    [first, first + count)
+
+    transaction() holds mmconfig exclusively, so tracked writers run one at a
+    time from reservation to commit and seqs become visible strictly in order.
+    A tracked save() or delete() costs five round trips: begin, this
+    reservation, write, changelog insert and commit.  save_many() reserves its
+    whole range in one call and writes every document in one transaction, so
+    bulk writers should prefer it.
+    """
+    if count < 1:
+        raise ValueError("count must be >= 1")
+
+    query = '''
+        UPSERT { _key: @key }
+            INSERT { _key: @key, value: @count }
+            UPDATE { value: OLD.value + @count }
+            IN mmconfig
+            OPTIONS { exclusive: true }
+            RETURN NEW.value
+    '''
+    for attempt in range(retries):
+        try:
+            last = next(db.aql.execute(query, bind_vars={'key': SEQUENCE_KEY, 'count': count}))
+            return last - count + 1
+        except AQLQueryExecuteError as e:
+            # 1200: write-write conflict, another writer got the counter first
+            if e.error_code != 1200 or attempt == retries - 1:
+                raise
+
+
+@contextmanager
+def transaction (db: Database, collection: str):
+    """Stream transaction spanning a tracked collection, the changelog and its counter
+
+    db          --  db handle from mediamgr.connect()
+    collection  --  name of the collection being written
+
+    Yields a transaction db handle; the seq reservation, document write and
+    changelog entry made through it commit (or abort) together.  mmconfig is
+    locked exclusively for the life of the transaction, which serializes
+    tracked writers and keeps the changelog free of gaps.
+
+    Example:
+        with transaction(db, 'cast') as txn:
+            seq = next_sequence(txn)
+            meta = txn.collection('cast').insert(doc)
+            record_changes(txn, 'cast', [...])
+    """
+    txn = db.begin_transaction(write=[collection, 'changelog'], exclusive=['mmconfig'])
+    try:
+        yield txn
+    except BaseException:
+        txn.abort_transaction()
+        raise
+    txn.commit_transaction()
+
+
+def record_changes (db: Database, collection: str, changes: List[dict]):
+    """Write changelog entries for a set of document changes
+
+    db          --  transaction db handle from transaction(), so the entries
+                    commit together with the document writes they describe
+    collection  --  name of the collection the changes were made in
+    changes     --  list of dicts with 'seq' (from next_sequence()), 'op'
+                    ('insert', 'update' or 'delete'), '_key' and optionally
+                    '_rev' of each changed document
+    """
+    if not changes:
+        return
+
+    timestamp = datetime.now(timezone.utc).isoformat()
+
+    entries = []
+    for change in changes:
+        entry = {
+            'seq': change['seq'],
+            'collection': collection,
+            'doc_key': change['_key'],
+            'op': change['op'],
+            'timestamp': timestamp
+        }
+        if change.get('_rev'):
+            entry['rev'] = change['_rev']
+        entries.append(entry)
+
+    db.collection('changelog').insert_many(entries, silent=True)
+
+
+class ChangeConsumer ():
+    """Reads the changelog incrementally on behalf of a named pipeline stage
+
+    Each consumer keeps its own checkpoint (the last seq it has processed) in
+    the mmconfig collection, so a stage only ever sees changes made since its
+    previous run.  Writers reserve seqs inside their transaction and commit
+    one at a time (see transaction()), so a seq is never visible before the
+    seqs below it.  Use commit() only after a batch has been fully processed
+    so that a crashed stage resumes from its last completed batch.
+    """
+
+    def __init__ (self, dbconn: Database, name: str, collections: List[str] = None):
+        """Instantiate a changelog consumer
+
+        dbconn      --  db handle from mediamgr.connect()
+        name        --  unique name of the consumer, used as the checkpoint key
+        collections --  only report changes in these collections
+                        None reports changes in all tracked collections
+        """
+        self.dbconn = dbconn
+        self.name = name
+        self.collections = collections
+        self.mmconfig = self.dbconn.collection('mmconfig')
+        self.checkpoint_key = CHECKPOINT_PREFIX + name
+
+
+    def checkpoint (self) -> int:
+        """Returns the last committed seq for this consumer (0 if none)"""
+        doc = self.mmconfig.get(self.checkpoint_key)
+        if doc is None:
+            return 0
+        return doc['seq']
+
+
+    def commit (self, seq: int):
+        """Store seq as the last processed changelog entry for this consumer"""
+        self.mmconfig.insert(
+            {'_key': self.checkpoint_key, 'seq': seq},
+            overwrite_mode='replace',
+            silent=True)
+
+
+    def _scan (self, since: int, batch_size: int) -> Tuple[List[dict], int]:
+        """Read up to batch_size changelog entries following since
+
+        Returns (entries in self.collections, last seq read).  Entries from
+        other collections count towards batch_size but are not returned, so
+        the checkpoint can still move past them.
+        """
+        bv = {'since': since, 'batch_size': batch_size, 'collections': self.collections}
+        query = '''
+            FOR c IN changelog
+                FILTER c.seq > @since
+                SORT c.seq
+                LIMIT @batch_size
+                LET wanted = @collections == null OR c.collection IN @collections
+                RETURN MERGE(c, {
+                    wanted: wanted,
+                    document: wanted AND c.op != "delete" ? DOCUMENT(CONCAT(c.collection, "/", c.doc_key)) : null
+                })
+        '''
+
+        entries = []
+        last = since
+        for c in self.dbconn.aql.execute(query, bind_vars=bv, batch_size=batch_size):
+            last = c['seq']
+            if c.pop('wanted'):
+                entries.append(c)
+        return entries, last
+
+
+    def changes (self, since: int = None, batch_size: int = 1000) -> List[dict]:
+        """Get a single batch of changelog entries after a given seq
+
+        since       --  seq to read after; None uses the stored checkpoint
+        batch_size  --  maximum number of entries to scan
+
+        Returns changelog entries in seq order.  Each entry carries the current version of the
+        changed document under 'document' (None once the document has been
+        deleted).
+        """
+        if since is None:
+            since = self.checkpoint()
+        return self._scan(since, batch_size)[0]
+
+
+    def batches (self, batch_size: int = 1000, commit: bool = True) -> Iterator[List[dict]]:
+        """Iterate over all pending changes in batches
+
+        batch_size  --  maximum number of entries scanned per batch
+        commit      --  advance the stored checkpoint after each batch has
+                        been handed back to (and processed by) the caller
+
+        Example:
+            for batch in ChangeConsumer(db, 'detect', ['media']).batches():
+                for change in batch:
+                    process(change['document'])
+        """
+        since = self.checkpoint()
+        while True:
+            batch, last = self._scan(since, batch_size)
+            if last == since:
+                return
+
+            if batch:
+                yield batch
+
+            since = last
+            if commit:
+                self.commit(since)
@@ -0,0 +1,307 @@
+"""Packed face-chip store addressed by face_identifier
+
+Chips are fixed-size aligned face crops (size x size x 3, uint8 RGB) appended
+to large pack files.  An SQLite index maps each face_identifier to its pack
+and slot.  Reads are zero-copy: get() returns a read-only NumPy view straight
+onto an mmap of the pack file.
+
+Layout of a store directory:
+    index.sqlite        --  face_identifier -> (pack, slot, put_at)
+    chips-000000.pack   --  slot n starts at n * stride bytes
+    chips-000001.pack
+    ...
+    lock                --  serializes writers across processes
+
+Pack numbers are allocated from a counter in the index and never reused, so a
+reader holding a map of a pack removed by compact() can never mistake a new
+pack for it.
+"""
+import mediamgr.config as config
+from mediamgr.localdb import sqlite_transaction
+import fcntl
+import mmap
+import numpy as np
+import os
+import sqlite3
+import time
+from typing import Dict, Iterable, List, Tuple
+
+
+PACK_FORMAT = 'chips-{:06d}.pack'
+COMPACT_GRACE = 86400   # seconds a chip is protected from compact(live=...) after it is written
+
+
+class ChipStore ():
+    """Append-only store of face chips backed by memory-mapped pack files
+
+    Any number of processes may read and write the same store; writers take an
+    exclusive file lock for the duration of each put_many()/compact().
+    """
+
+    def __init__ (self, path: str = None, size: int = None, pack_bytes: int = 1 << 30):
+        """Open (creating if needed) a chip store
+
+        path        --  store directory, defaults to config.chip_store_path
+        size        --  chip edge length in pixels, defaults to config.chip_size
+        pack_bytes  --  pack files are rolled over once they reach this size
+        """
+        self.path = path or config.chip_store_path
+        self.size = size or config.chip_size
+        self.shape = (self.size, self.size, 3)
+        self.chip_bytes = self.size * self.size * 3
+        self.stride = (self.chip_bytes + 63) & ~63     # keep every slot 64-byte aligned
+        self.pack_bytes = pack_bytes
+
+        os.makedirs(self.path, exist_ok=True)
+        self.index = sqlite3.connect(os.path.join(self.path, 'index.sqlite'), isolation_level=None, timeout=30)
+        self.index.execute('PRAGMA journal_mode=WAL')
+        self.index.executescript('''
+            CREATE TABLE IF NOT EXISTS meta (
+                name    TEXT PRIMARY KEY,
+                value   INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS chips (
+                face_identifier TEXT PRIMARY KEY,
+                pack            INTEGER NOT NULL,
+                slot            INTEGER NOT NULL,
+                put_at          REAL NOT NULL DEFAULT 0
+            ) WITHOUT ROWID;
+        ''')
+        self.index.executemany('INSERT OR IGNORE INTO meta VALUES (?, ?)',
+                               [('size', self.size), ('next_pack', 0)])
+        stored = self._meta('size')
+        if stored != self.size:
+            raise ValueError("chip store at '{}' holds {}px chips, not {}px".format(self.path, stored, self.size))
+
+        self._maps = {}     # pack number -> mmap.mmap
+
+
+    def __contains__ (self, face_identifier: str) -> bool:
+        return self.index.execute(
+            'SELECT 1 FROM chips WHERE face_identifier = ?', (face_identifier,)).fetchone() is not None
+
+
+    def __len__ (self) -> int:
+        return self.index.execute('SELECT COUNT(*) FROM chips').fetchone()[0]
+
+
+    def _meta (self, name: str) -> int:
+        row = self.index.execute('SELECT value FROM meta WHERE name = ?', (name,)).fetchone()
+        return None if row is None else row[0]
+
+
+    def _set_meta (self, name: str, value: int):
+        self.index.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (name, value))
+
+
+    def _allocate_pack (self) -> int:
+        """Returns a pack number never used before (caller holds the lock)"""
+        with sqlite_transaction(self.index):
+            pack = self._meta('next_pack')
+            self._set_meta('next_pack', pack + 1)
+        return pack
+
+
+    def _lock (self):
+        return _FileLock(os.path.join(self.path, 'lock'))
+
+
+    def _pack_path (self, pack: int) -> str:
+        return os.path.join(self.path, PACK_FORMAT.format(pack))
+
+
+    def _packs (self) -> List[int]:
+        return sorted( int(_[6:12]) for _ in os.listdir(self.path)
+                       if _.startswith('chips-') and _.endswith('.pack') )
+
+
+    def _view (self, pack: int, slot: int) -> np.ndarray:
+        offset = slot * self.stride
+        mm = self._maps.get(pack)
+        if mm is None or offset + self.chip_bytes > len(mm):
+            # first access, or the pack has grown since it was mapped; pack
+            # numbers are never reused, so a cached map is never of another file
+            with open(self._pack_path(pack), 'rb') as f:
+                mm = self._maps[pack] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return np.frombuffer(mm, dtype=np.uint8, count=self.chip_bytes, offset=offset).reshape(self.shape)
+
+
+    def close (self):
+        # views handed out keep their own reference to the underlying mmap
+        self._maps = {}
+        self.index.close()
+
+
+    def discard (self, face_identifiers: Iterable[str]) -> int:
+        """Drop chips from the index; their space is reclaimed by compact()
+
+        Returns the number of chips discarded
+        """
+        with self._lock(), sqlite_transaction(self.index):
+            cur = self.index.executemany('DELETE FROM chips WHERE face_identifier = ?',
+                                         [ (_,) for _ in face_identifiers ])
+            return cur.rowcount
+
+
+    def get (self, face_identifier: str) -> np.ndarray:
+        """Returns a read-only (size, size, 3) uint8 view of a chip
+
+        Raises KeyError if the store has no chip for face_identifier
+        """
+        row = self.index.execute(
+            'SELECT pack, slot FROM chips WHERE face_identifier = ?', (face_identifier,)).fetchone()
+        if row is None:
+            raise KeyError(face_identifier)
+        return self._view(*row)
+
+
+    def get_many (self, face_identifiers: List[str]) -> List[np.ndarray]:
+        """Returns views for a list of chips, in input order (None where missing)"""
+        locations = {}
+        for i in range(0, len(face_identifiers), 500):
+            chunk = face_identifiers[i:i + 500]
+            locations.update( (_[0], (_[1], _[2])) for _ in self.index.execute(
+                'SELECT face_identifier, pack, slot FROM chips WHERE face_identifier IN ({})'.format(
+                    ','.join('?' * len(chunk))), chunk) )
+        return [ self._view(*locations[_]) if _ in locations else None for _ in face_identifiers ]
+
+
+    def put_many (self, chips: Iterable[Tuple[str, np.ndarray]]) -> int:
+        """Append a batch of chips
+
+        chips   --  (face_identifier, (size, size, 3) uint8 array) tuples
+                    chips already in the store, and repeats of an id within
+                    the batch, are skipped
+
+        The batch is written with a single append and fsync followed by a
+        single index transaction.  Returns the number of chips written
+        """
+        with self._lock():
+            batch = []
+            seen = set()
+            now = time.time()
+            for face_identifier, chip in chips:
+                if face_identifier in seen or face_identifier in self:
+                    continue
+                seen.add(face_identifier)
+                chip = np.ascontiguousarray(chip, dtype=np.uint8)
+                if chip.shape != self.shape:
+                    raise ValueError("chip '{}' has shape {}, expected {}".format(
+                        face_identifier, chip.shape, self.shape))
+                batch.append((face_identifier, chip, now))
+            if not batch:
+                return 0
+
+            pack = self._meta('current_pack')
+            if pack is None or (os.path.exists(self._pack_path(pack))
+                                and os.path.getsize(self._pack_path(pack)) >= self.pack_bytes):
+                pack = self._allocate_pack()
+                with sqlite_transaction(self.index):
+                    self._set_meta('current_pack', pack)
+
+            self._append(pack, batch)
+            return len(batch)
+
+
+    def _append (self, pack: int, batch: List[Tuple[str, np.ndarray, float]]):
+        """Write chips to the end of a pack and index them (caller holds the lock)"""
+        padding = b'\0' * (self.stride - self.chip_bytes)
+        with open(self._pack_path(pack), 'ab') as f:
+            # anything past the last whole slot is a torn write from a crash
+            end = f.tell()
+            first = end // self.stride + (1 if end % self.stride else 0)
+            f.write(b'\0' * (first * self.stride - end))
+            for _, chip, _ in batch:
+                f.write(chip.tobytes())
+                f.write(padding)
+            f.flush()
+            os.fsync(f.fileno())
+
+        with sqlite_transaction(self.index):
+            self.index.executemany('INSERT OR REPLACE INTO chips VALUES (?, ?, ?, ?)',
+                                   [ (face_identifier, pack, first + i, put_at)
+                                     for i, (face_identifier, _, put_at) in enumerate(batch) ])
+
+
+    def stats (self) -> Dict[int, dict]:
+        """Returns {pack: {'slots': n, 'live': n}} for every pack file"""
+        live = dict(self.index.execute('SELECT pack, COUNT(*) FROM chips GROUP BY pack'))
+        return { _: {'slots': os.path.getsize(self._pack_path(_)) // self.stride, 'live': live.get(_, 0)}
+                 for _ in self._packs() }
+
+
+    def compact (self, live: Iterable[str] = None, min_garbage: float = 0.25,
+                 grace: float = COMPACT_GRACE) -> int:
+        """Reclaim space used by discarded chips
+
+        live        --  optional set of face_identifiers still in use (e.g. from
+                        live_face_identifiers()); indexed chips not in it and
+                        written more than grace seconds ago are discarded first
+        min_garbage --  only rewrite packs with at least this fraction of dead slots
+        grace       --  age in seconds below which chips are kept even if not in live
+
+        The pipeline writes chips (embed stage) before it creates their faces
+        documents (store stage), so a live set taken from the db is missing
+        faces still in flight.  grace must exceed the time a task can spend
+        between those stages, including retries; alternatively take the live
+        set only after the work queue has drained and pass grace=0.
+
+        Live chips from sparse packs are copied into a new pack and the old
+        pack files removed.  Views obtained before compaction stay valid.
+        Returns the number of pack files removed
+        """
+        with self._lock():
+            if live is not None:
+                live = set(live)
+                cutoff = time.time() - grace
+                dead = [ _[0] for _ in self.index.execute(
+                            'SELECT face_identifier FROM chips WHERE put_at < ?', (cutoff,))
+                         if _[0] not in live ]
+                with sqlite_transaction(self.index):
+                    self.index.executemany('DELETE FROM chips WHERE face_identifier = ?', [ (_,) for _ in dead ])
+
+            if not self._packs():
+                return 0
+            stats = self.stats()
+            sparse = [ p for p, s in stats.items()
+                       if s['slots'] == 0 or (s['slots'] - s['live']) / s['slots'] >= min_garbage ]
+            if not sparse:
+                return 0
+
+            # copy survivors into a fresh pack in batches, then drop the old files
+            target = self._allocate_pack()
+            for p in sparse:
+                rows = self.index.execute('SELECT face_identifier, slot, put_at FROM chips WHERE pack = ? ORDER BY slot',
+                                          (p,)).fetchall()
+                for i in range(0, len(rows), 1000):
+                    self._append(target, [ (face_identifier, self._view(p, slot), put_at)
+                                           for face_identifier, slot, put_at in rows[i:i + 1000] ])
+            if self._meta('current_pack') in sparse:
+                with sqlite_transaction(self.index):
+                    self._set_meta('current_pack', target)
+
+            for p in sparse:
+                self._maps.pop(p, None)
+                os.remove(self._pack_path(p))
+            return len(sparse)
+
+
+def live_face_identifiers (db) -> List[str]:
+    """Returns the face_identifier of every document in the 'faces' collection
+
+    db  --  db handle from mediamgr.connect()
+    """
+    return list(db.aql.execute('FOR f IN faces RETURN f.face_identifier', batch_size=10000))
+
+
+class _FileLock ():
+    def __init__ (self, path: str):
+        self.path = path
+
+    def __enter__ (self):
+        self.f = open(self.path, 'a')
+        fcntl.flock(self.f, fcntl.LOCK_EX)
+
+    def __exit__ (self, exc_type, exc, tb):
+        fcntl.flock(self.f, fcntl.LOCK_UN)
+        self.f.close()
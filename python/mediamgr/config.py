@@ -1,4 +1,29 @@
 arango_url="http://mediamgr.is-leet.com:8529"
 arango_dbname="mediamgr"
 arango_username="mediamgr"
-arango_password="mediamgr"
\ No newline at end of file
+arango_password="mediamgr"
+
+# ArangoDB transport (see mediamgr.transport)
+# arango_url may also be a list (or comma separated string) of coordinator urls
+arango_host_resolver="fallback"     # 'fallback' (failover in listed order), 'roundrobin' or 'random'
+arango_resolver_max_tries=None      # hosts tried per request; None tries each host
+arango_request_timeout=60           # seconds
+arango_pool_maxsize=32              # kept-alive connections per host
+arango_pool_block=True              # wait for a pooled connection instead of opening extras
+arango_retry_attempts=3             # idempotent reads timing out or failing with 429/5xx
+arango_retry_backoff=0.5            # exponential backoff base in seconds
+arango_request_compression_threshold=4096   # deflate request bodies at least this big; None disables
+arango_response_compression="gzip"  # Accept-Encoding for responses; None disables
+
+# local pipeline settings (see mediamgr.pipeline)
+cas_path="/var/lib/mediamgr/cas"
+cas_state_path="/var/lib/mediamgr/cas_verify.sqlite"  # see mediamgr.cas
+cas_verify_rate=50      # MB/s read limit while verifying; 0 for unlimited
+cas_recheck_days=30     # verified objects are skipped for this long
+cas_grace_hours=24      # objects changed more recently are never reported orphaned or quarantined
+work_queue_path="/var/lib/mediamgr/workqueue.sqlite"
+chip_store_path="/var/lib/mediamgr/chips"
+chip_size=150
+face_detector_model="../models/mmod_human_face_detector.dat"
+shape_predictor_model="../models/shape_predictor_5_face_landmarks.dat"
+face_recognition_model="../models/dlib_face_recognition_resnet_model_v1.dat"
@@ -0,0 +1,20 @@
+"""Helpers for the local SQLite state files (work queue, chip index, CAS state)"""
+from contextlib import contextmanager
+import sqlite3
+
+
+@contextmanager
+def sqlite_transaction (conn: sqlite3.Connection):
+    """Immediate (write-locked) transaction on an autocommit connection
+
+    conn    --  sqlite3 connection opened with isolation_level=None
+
+    Commits on success, rolls back if the block raises
+    """
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
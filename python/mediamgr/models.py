@@ -1,20 +1,31 @@
 import mediamgr.aql as aql
+import mediamgr.changes as changes
 import mediamgr.config as config
-from mediamgr.schema import collections, graphs, indexes, schema
+import mediamgr.transport as transport
+import mediamgr.views as views
+from mediamgr.schema import collections, graphs, indexes, internal_collections, schema
 import arango
 from arango.cursor import Cursor
 from arango.database import Database
 from arango.result import Result
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 import json
+from typing import Iterator, List
 from jsonschema.validators import validate as json_validate
 
 
+def index_fields (collection: str) -> list:
+    """Returns the field lists of the persistent indexes declared for a collection"""
+    return [ _ if isinstance(_, list) else [_] for _ in indexes.get(collection, []) ]
+
+
 def connect () -> Database:
     """Connect to ArangoDB
 
-    uses connection settings in mediamgr.config
+    uses connection and transport settings in mediamgr.config
     """
-    client = arango.ArangoClient(hosts=config.arango_url)
+    client = arango.ArangoClient(**transport.client_options())
     db = client.db(
             config.arango_dbname, 
             username=config.arango_username, 
@@ -46,8 +57,8 @@ def connect () -> Database:
             if c in indexes:
                 # this is only safe because we just created the collection
                 # schema updates need to check if an index exists first
-                for field in indexes[c]:
-                    db.collection(c).add_persistent_index(fields=[field])
+                for fields in index_fields(c):
+                    db.collection(c).add_persistent_index(fields=fields)
             
             loaded_versions['schemas'][c] = schema[c]['version']
             schema_updated = True
@@ -57,10 +68,10 @@ def connect () -> Database:
             db.collection(c).configure(schema=schema[c]['schema'])
 
             if c in indexes:
-                indexed_fields = [ _['fields'][0] for _ in db.collection(c).indexes() ]
-                for field in indexes[c]:
-                    if field not in indexed_fields:
-                        db.collection(c).add_persistent_index(fields=[field])
+                indexed_fields = [ _['fields'] for _ in db.collection(c).indexes() ]
+                for fields in index_fields(c):
+                    if fields not in indexed_fields:
+                        db.collection(c).add_persistent_index(fields=fields)
 
             loaded_versions['schemas'][c] = schema[c]['version']
             schema_updated = True
@@ -122,11 +133,127 @@ class CollectionDocument ():
 
         self.prohibited_keys = ["_id"]  # arangodb managed, filtered just prior to save
 
+        self.track_changes = collection not in internal_collections
+                                # record saves/deletes in the changelog (see mediamgr.changes)
+
     
     def __repr__ (self):
         return json.dumps(self.document, indent=4, sort_keys=True)
 
 
+    @contextmanager
+    def _writer (self):
+        """Yields the db handle to write through
+
+        When tracking changes this is a stream transaction spanning the
+        collection and the changelog (see mediamgr.changes.transaction), so a
+        document write and its changelog entry land together or not at all.
+        """
+        if not self.track_changes:
+            yield self.dbconn
+            return
+        with changes.transaction(self.dbconn, self.collection_name) as txn:
+            yield txn
+
+
+    def _chunked_query (self, query: str, keys: List[str], chunk_size: int, workers: int) -> list:
+        """Run a query returning one result per key over chunks of keys, in parallel
+
+        Results are concatenated in input order
+        """
+        chunks = [ keys[i:i + chunk_size] for i in range(0, len(keys), chunk_size) ]
+
+        def run (chunk):
+            bv = {'@collection': self.collection_name, 'keys': chunk}
+            return list(self.dbconn.aql.execute(query, bind_vars=bv, batch_size=len(chunk)))
+
+        if len(chunks) <= 1 or workers <= 1:
+            results = [ run(_) for _ in chunks ]
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(run, chunks))
+
+        return [ _ for chunk in results for _ in chunk ]
+
+
+    def delete (self) -> dict:
+        """Delete the current document from the collection
+
+        Returns the metadata from the server after the delete
+        """
+        self.id_required()
+
+        with self._writer() as db:
+            metadata = db.collection(self.collection_name).delete(self._key)
+
+            if self.track_changes:
+                changes.record_changes(db, self.collection_name, [
+                    {'seq': changes.next_sequence(db), 'op': 'delete', '_key': self._key, '_rev': metadata['_rev']}
+                ])
+
+        self.document = None
+        self._id = self._key = self._rev = ''
+        return metadata
+
+
+    def exists_many (self, keys: List[str], chunk_size: int = 1000, workers: int = 4) -> List[bool]:
+        """Check which of a list of documents exist
+
+        keys        --  list of document _key or _id values
+        chunk_size  --  keys looked up per query
+        workers     --  chunks queried in parallel
+
+        Returns a list of booleans in the same order as keys.  Only the primary
+        index is consulted; document bodies are never read.  An _id from
+        another collection is reported as not existing, as in get_many().
+        """
+        query = """
+            FOR k IN @keys
+                RETURN LENGTH(
+                    FOR d IN @@collection
+                        FILTER d._key == k
+                        LIMIT 1
+                        RETURN 1
+                ) > 0
+        """
+        lookup = []
+        for k in keys:
+            if '/' in k:
+                collection, k = k.split('/', 1)
+                if collection != self.collection_name:
+                    k = None    # matches no document
+            lookup.append(k)
+        return self._chunked_query(query, lookup, chunk_size, workers)
+
+
+    def find_views (self, filters: dict = None, batch_size: int = 1000) -> Iterator[views.DocumentView]:
+        """Iterate over documents in the collection as read-only views
+
+        filters     --  optional {property: value} equality filters
+        batch_size  --  documents fetched per cursor round trip
+
+        Only the fields declared in the collection's schema are fetched.
+        Use view.to_document(dbconn) to get an editable document back.
+        """
+        view = views.view_types[self.collection_name]
+        bv = {'@collection': self.collection_name, 'fields': list(view.fields)}
+        conditions = []
+        for i, (k, v) in enumerate((filters or {}).items()):
+            conditions.append('FILTER d.@attr{0} == @value{0}'.format(i))
+            bv['attr{}'.format(i)] = k
+            bv['value{}'.format(i)] = v
+
+        query = """
+            FOR d IN @@collection
+                {}
+                RETURN KEEP(d, @fields)
+        """.format('\n'.join(conditions))
+
+        return views.iter_views(
+            self.dbconn.aql.execute(query, bind_vars=bv, batch_size=batch_size, stream=True),
+            self.collection_name)
+
+
     def get (self, query: str):
         """Get a record from a collection
 
@@ -137,6 +264,23 @@ class CollectionDocument ():
         self.setDocument(self.collection.get(query))
 
 
+    def get_many (self, keys: List[str], chunk_size: int = 1000, workers: int = 4) -> List[dict]:
+        """Get many records from the collection
+
+        keys        --  list of document _key or _id values
+        chunk_size  --  keys fetched per query
+        workers     --  chunks fetched in parallel
+
+        Returns raw documents in the same order as keys, with None for keys
+        that do not exist.  The current document (self.document) is unchanged.
+        """
+        query = """
+            FOR k IN @keys
+                RETURN DOCUMENT(@@collection, k)
+        """
+        return self._chunked_query(query, keys, chunk_size, workers)
+
+
     def id_required (self):
         """Verifies the _id property is set"""
         if not self._id:
@@ -170,10 +314,23 @@ class CollectionDocument ():
             except KeyError:
                 pass
 
-        if '_rev' in self.document:
-            metadata = self.collection.update(self.document)
-        else:
-            metadata = self.collection.insert(self.document)
+        op = 'update' if '_rev' in self.document else 'insert'
+
+        with self._writer() as db:
+            if self.track_changes:
+                self.document[changes.SEQUENCE_FIELD] = changes.next_sequence(db)
+
+            collection = db.collection(self.collection_name)
+            if op == 'update':
+                metadata = collection.update(self.document)
+            else:
+                metadata = collection.insert(self.document)
+
+            if self.track_changes:
+                changes.record_changes(db, self.collection_name, [
+                    {'seq': self.document[changes.SEQUENCE_FIELD], 'op': op,
+                     '_key': metadata['_key'], '_rev': metadata['_rev']}
+                ])
 
         self._id = self.document['_id'] = metadata['_id']
         self._key = self.document['_key'] = metadata['_key']
@@ -182,6 +339,85 @@ class CollectionDocument ():
         return metadata
 
 
+    def save_many (self, documents: list) -> list:
+        """Save a list of collection documents in bulk
+
+        documents   --  list of dicts conforming to the collection schema
+                        documents containing '_rev' are updated, all others inserted
+
+        Validates every document before anything is written.  Documents are
+        updated in place with _id, _key and _rev, the same as save().  If the
+        server rejects any document, the first error is raised; in collections
+        with track_changes nothing is written in that case, otherwise the
+        remaining documents are still saved.
+        Returns the metadata from the server for each document, in input order
+        """
+        for document in documents:
+            self.validate(document=document)
+
+        for document in documents:
+            for k in self.prohibited_keys:
+                try:
+                    del document[k]
+                except KeyError:
+                    pass
+
+        if not documents:
+            return []
+
+        ops = [ 'update' if '_rev' in _ else 'insert' for _ in documents ]
+
+        results = [None] * len(documents)
+        failed = None
+        with self._writer() as db:
+            if self.track_changes:
+                first = changes.next_sequence(db, count=len(documents))
+                for seq, document in enumerate(documents, start=first):
+                    document[changes.SEQUENCE_FIELD] = seq
+
+            collection = db.collection(self.collection_name)
+            for op in ('update', 'insert'):
+                batch = [ i for i, _ in enumerate(ops) if _ == op ]
+                if not batch:
+                    continue
+
+                if op == 'update':
+                    metadata = collection.update_many([ documents[i] for i in batch ])
+                else:
+                    metadata = collection.insert_many([ documents[i] for i in batch ])
+
+                for i, meta in zip(batch, metadata):
+                    if isinstance(meta, Exception):
+                        failed = failed or meta
+                        continue
+                    results[i] = meta
+
+            if self.track_changes:
+                # a rejected document would leave its seq unused, so tracked
+                # batches are all or nothing: raising aborts the transaction
+                if failed is not None:
+                    raise failed
+                changes.record_changes(db, self.collection_name, [
+                    {
+                        'seq': documents[i][changes.SEQUENCE_FIELD],
+                        'op': ops[i],
+                        '_key': meta['_key'],
+                        '_rev': meta['_rev']
+                    } for i, meta in enumerate(results)
+                ])
+
+        for document, meta in zip(documents, results):
+            if meta is not None:
+                document['_id'] = meta['_id']
+                document['_key'] = meta['_key']
+                document['_rev'] = meta['_rev']
+
+        if failed is not None:
+            raise failed
+
+        return results
+
+
     def setDocument (self, document: dict):
         """setter method for the collection document
         
@@ -352,6 +588,14 @@ class MediaDocument (CollectionDocument):
         return f.collection.find({'media_id': self._id})
 
 
+    def query (self, page_size: int = 100) -> aql.MediaQuery:
+        """Start an index-backed search over the typed metadata fields
+
+        Returns a mediamgr.aql.MediaQuery; see there for usage
+        """
+        return aql.MediaQuery(self.dbconn, page_size=page_size)
+
+
 class AppearsInDocument (CollectionDocument):
     """Derived class for documents in the 'appears_in' edge collection"""
 
@@ -365,3 +609,12 @@ class FaceMatchesFaceDocument (CollectionDocument):
     def __init__(self, dbconn: Database):
         super().__init__(dbconn, 'face_matches_face')
 
+
+# collection name -> CollectionDocument subclass
+document_classes = {
+    'appears_in': AppearsInDocument,
+    'cast': CastDocument,
+    'face_matches_face': FaceMatchesFaceDocument,
+    'faces': FacesDocument,
+    'media': MediaDocument
+}
@@ -0,0 +1,435 @@
+"""Local ingest -> probe -> detect -> embed -> store pipeline
+
+Each stage is a plain function taking a task payload (dict) and returning a
+list of (key, payload) tuples for the next stage.  The Scheduler runs every
+stage in its own pool of worker processes, with work handed between stages
+through a durable mediamgr.workqueue.WorkQueue.
+
+Usage:
+    python -m mediamgr.pipeline [--queue path] [src_dir_or_file ...]
+"""
+import mediamgr.config as config
+from mediamgr.workqueue import WorkQueue
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timezone
+import hashlib
+import logging
+import os
+import time
+from typing import Callable, Dict, List, NamedTuple
+
+
+log = logging.getLogger(__name__)
+
+IMAGE_FORMATS = ['image2', 'png_pipe', 'jpeg_pipe', 'bmp_pipe', 'gif', 'webp_pipe']
+
+
+# per-process caches, populated lazily inside worker processes
+_models = {}
+_db = None
+_chips = None
+
+
+def _model (name: str):
+    """Load (once per worker process) and return a dlib model by config name"""
+    if name not in _models:
+        import dlib
+        path = getattr(config, name)
+        if name == 'face_detector_model':
+            _models[name] = dlib.cnn_face_detection_model_v1(path)
+        elif name == 'shape_predictor_model':
+            _models[name] = dlib.shape_predictor(path)
+        elif name == 'face_recognition_model':
+            _models[name] = dlib.face_recognition_model_v1(path)
+        else:
+            raise ValueError("unknown model '{}'".format(name))
+    return _models[name]
+
+
+def _chipstore ():
+    """Returns this worker process's face-chip store, opening it on first use"""
+    global _chips
+    if _chips is None:
+        from mediamgr.chipstore import ChipStore
+        _chips = ChipStore()
+    return _chips
+
+
+def _dbconn ():
+    """Returns this worker process's db handle, connecting on first use"""
+    global _db
+    if _db is None:
+        from mediamgr.models import connect
+        _db = connect()
+    return _db
+
+
+def md5sum (path: str, blocksize: int = 1 << 20) -> str:
+    """Returns the hex md5 digest of a file's contents"""
+    h = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def media_metadata (probe: dict) -> dict:
+    """Derive the typed, indexed media metadata fields from ffprobe output
+
+    see mediamgr.schema.media_metadata_fields
+
+    Cover art embedded in audio files (mp3, m4a, ...) is reported by ffprobe
+    as a video stream with disposition.attached_pic set; such streams do not
+    make a file a video.
+    """
+    fmt = probe.get('format', {})
+    streams = probe.get('streams', [])
+    video = [ _ for _ in streams if _.get('codec_type') == 'video'
+              and not _.get('disposition', {}).get('attached_pic') ]
+
+    if fmt.get('format_name') in IMAGE_FORMATS:
+        media_type = 'image'
+    elif video:
+        media_type = 'video'
+    else:
+        media_type = 'audio'
+
+    metadata = {
+        'type': media_type,
+        'duration': 0.0 if media_type == 'image' else float(fmt.get('duration', 0) or 0),
+        'size': int(fmt.get('size', 0) or 0)
+    }
+    if video:
+        metadata['width'] = int(video[0].get('width', 0))
+        metadata['height'] = int(video[0].get('height', 0))
+    return metadata
+
+
+def ingest (payload: dict) -> list:
+    """Hard link a source file into the CAS directory (see cas/ingest.sh)
+
+    payload     --  {'source': path of the file to ingest}
+    """
+    source = payload['source']
+    md5 = md5sum(source)
+    ext = os.path.splitext(source)[1]
+    target = os.path.join(config.cas_path, md5 + ext)
+    try:
+        os.link(source, target)
+    except FileExistsError:
+        pass    # identical content already ingested
+
+    return [(md5, {'md5': md5, 'path': target, 'source': source})]
+
+
+def probe (payload: dict) -> list:
+    """Read container/stream metadata with ffprobe"""
+    import ffmpeg
+    payload['probe'] = ffmpeg.probe(payload['path'])
+    return [(payload['md5'], payload)]
+
+
+def detect (payload: dict) -> list:
+    """Run the CNN face detector over still images
+
+    Anything media_metadata() does not classify as an image (including audio
+    files with embedded cover art) passes through with no faces
+    """
+    payload['faces'] = []
+    if media_metadata(payload['probe'])['type'] == 'image':
+        import dlib
+        img = dlib.load_rgb_image(payload['path'])
+        for i, d in enumerate(_model('face_detector_model')(img, 1)):
+            payload['faces'].append({
+                'face_identifier': '{}_{}'.format(payload['md5'], i),
+                'rect': [d.rect.left(), d.rect.top(), d.rect.right(), d.rect.bottom()],
+                'confidence': d.confidence
+            })
+    return [(payload['md5'], payload)]
+
+
+def embed (payload: dict) -> list:
+    """Compute a face descriptor and aligned face chip for each detected face
+
+    Chips for the whole image are written to the chip store as one batch
+    """
+    if payload['faces']:
+        import dlib
+        img = dlib.load_rgb_image(payload['path'])
+        chips = []
+        for face in payload['faces']:
+            rect = dlib.rectangle(*face['rect'])
+            shape = _model('shape_predictor_model')(img, rect)
+            descriptor = _model('face_recognition_model').compute_face_descriptor(img, shape)
+            face['embedding'] = list(descriptor)
+            chips.append((face['face_identifier'], dlib.get_face_chip(img, shape, size=config.chip_size)))
+        _chipstore().put_many(chips)
+    return [(payload['md5'], payload)]
+
+
+def store (payload: dict) -> list:
+    """Write the media document and its faces to the db
+
+    Keys are derived from the content hash, so re-running a task whose db
+    write already landed before a crash does not create duplicates.
+    """
+    from mediamgr.models import FacesDocument, MediaDocument
+    db = _dbconn()
+    md5 = payload['md5']
+
+    m = MediaDocument(db)
+    if not m.collection.has(md5):
+        metadata = media_metadata(payload['probe'])
+        metadata.update({
+            'md5': md5,
+            'ingested': datetime.now(timezone.utc).isoformat(),
+            'path': payload['path'],
+            'source': payload['source'],
+            'probe': payload['probe']
+        })
+        m.new({'_key': md5, 'metadata': metadata})
+        m.save()
+    media_id = 'media/' + md5
+
+    f = FacesDocument(db)
+    faces = []
+    exists = f.exists_many([ _['face_identifier'] for _ in payload['faces'] ])
+    for face, found in zip(payload['faces'], exists):
+        if found:
+            continue
+        face_identifier = face['face_identifier']
+        faces.append({
+            '_key': face_identifier,
+            'face_identifier': face_identifier,
+            'media_id': media_id,
+            'cast_id': '',
+            'rect': face['rect'],
+            'confidence': face['confidence'],
+            'embedding': face.get('embedding', [])
+        })
+    f.save_many(faces)
+
+    return []
+
+
+class Stage (NamedTuple):
+    """A pipeline stage
+
+    name            --  queue stage name
+    func            --  module-level function(payload) -> [(key, payload), ...]
+    workers         --  size of the stage's process pool
+    next            --  name of the stage that receives func's output (None if terminal)
+    max_pending     --  backpressure: stop feeding this stage while its successor
+                        already has this many pending tasks
+    max_attempts    --  failures tolerated before a task is parked as failed
+    """
+    name: str
+    func: Callable[[dict], list]
+    workers: int = 1
+    next: str = None
+    max_pending: int = 1000
+    max_attempts: int = 3
+
+
+# default stage layout; detection/embedding are GPU bound, so keep those narrow
+stages = [
+    Stage('ingest', ingest, workers=4, next='probe'),
+    Stage('probe', probe, workers=os.cpu_count() or 1, next='detect'),
+    Stage('detect', detect, workers=1, next='embed', max_pending=100),
+    Stage('embed', embed, workers=1, next='store', max_pending=100),
+    Stage('store', store, workers=4)
+]
+
+
+class Scheduler ():
+    """Runs pipeline stages over a WorkQueue with per-stage process pools
+
+    Only one Scheduler may run against a given queue at a time.  Tasks left
+    running by a previous (crashed) scheduler are re-queued at startup;
+    completed tasks are never redone.
+
+    A worker process dying (e.g. a segfault in native code) fails every task
+    on its pool, not just the one that killed it.  Those tasks are not charged
+    an attempt; they are rerun one at a time on a separate single-worker pool,
+    where a crash can only be the running task's, and are kept off the shared
+    pool from then on.
+    """
+
+    def __init__ (self, queue: WorkQueue, stages: List[Stage] = stages,
+                  prefetch: int = 2, report_interval: float = 30.0):
+        """Instantiate a scheduler
+
+        queue           --  WorkQueue holding the pipeline's tasks
+        stages          --  Stage definitions, in pipeline order
+        prefetch        --  in-flight tasks allowed per worker process
+        report_interval --  seconds between progress log lines
+        """
+        self.queue = queue
+        self.stages = stages
+        self.prefetch = prefetch
+        self.report_interval = report_interval
+
+        self.completed = { _.name: 0 for _ in stages }
+        self.started = None
+        self.suspects = set()   # ids of tasks that were on a pool when it broke
+
+
+    def report (self) -> Dict[str, dict]:
+        """Returns per-stage queue depth and throughput (tasks/s since start)
+
+        e.g. {'probe': {'pending': 10, 'running': 4, 'done': 100, 'failed': 0, 'rate': 3.2}}
+        """
+        elapsed = max(time.time() - (self.started or time.time()), 1e-9)
+        depth = self.queue.depth()
+        result = {}
+        for stage in self.stages:
+            counts = depth.get(stage.name, dict.fromkeys(
+                (WorkQueue.PENDING, WorkQueue.RUNNING, WorkQueue.DONE, WorkQueue.FAILED), 0))
+            counts['rate'] = self.completed[stage.name] / elapsed
+            result[stage.name] = counts
+        return result
+
+
+    def run (self, drain: bool = True, poll: float = 1.0):
+        """Process tasks until the queue is empty (drain) or forever
+
+        drain   --  return once no stage has pending or in-flight work
+        poll    --  seconds to wait for results before re-checking the queue
+        """
+        recovered = self.queue.recover()
+        if recovered:
+            log.info("re-queued %d tasks left running by a previous run", recovered)
+
+        self.started = last_report = time.time()
+        executors = { _.name: ProcessPoolExecutor(max_workers=_.workers) for _ in self.stages }
+        isolated = { _.name: ProcessPoolExecutor(max_workers=1) for _ in self.stages }
+        held = { _.name: deque() for _ in self.stages }     # claimed suspects awaiting an isolated run
+        inflight = {}   # future -> (Stage, Task, executor, alone)
+
+        try:
+            while True:
+                self._fill(executors, isolated, held, inflight)
+
+                if not inflight:
+                    if drain and not any( self.queue.pending(_.name) for _ in self.stages ):
+                        break
+                    time.sleep(poll)
+                    continue
+
+                done, _ = wait(inflight, timeout=poll, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, task, executor, alone = inflight.pop(future)
+                    try:
+                        outputs = future.result()
+                    except BrokenProcessPool as e:
+                        if alone:
+                            self._replace(isolated, stage, executor, 1)
+                            log.warning("%s %s crashed its worker (attempt %d)", stage.name, task.key, task.attempts)
+                            self.queue.fail(task, repr(e), max_attempts=stage.max_attempts)
+                        else:
+                            # may not be this task's fault; rerun it alone, uncharged
+                            self._replace(executors, stage, executor, stage.workers)
+                            self.suspects.add(task.id)
+                            held[stage.name].append(task)
+                        continue
+                    except Exception as e:
+                        log.warning("%s %s failed (attempt %d): %r", stage.name, task.key, task.attempts, e)
+                        self.queue.fail(task, repr(e), max_attempts=stage.max_attempts)
+                        continue
+                    self.queue.complete(task, stage.next, outputs)
+                    self.suspects.discard(task.id)
+                    self.completed[stage.name] += 1
+
+                if time.time() - last_report >= self.report_interval:
+                    self._log_report()
+                    last_report = time.time()
+        finally:
+            for executor in list(executors.values()) + list(isolated.values()):
+                executor.shutdown(wait=True)
+
+        self._log_report()
+
+
+    def _fill (self, executors: dict, isolated: dict, held: dict, inflight: dict):
+        """Claim and submit work for every stage with free capacity"""
+        busy = { name: len(tasks) for name, tasks in held.items() }
+        alone = set()
+        for stage, _, _, is_alone in inflight.values():
+            busy[stage.name] += 1
+            if is_alone:
+                alone.add(stage.name)
+
+        # downstream first, so finished work drains before new work is admitted
+        for stage in reversed(self.stages):
+            room = stage.workers * self.prefetch - busy[stage.name]
+            if room <= 0:
+                continue
+            if stage.next is not None:
+                room = min(room, stage.max_pending - self.queue.pending(stage.next))
+                if room <= 0:
+                    continue    # backpressure from the next stage
+
+            tasks = []
+            for task in self.queue.claim(stage.name, room):
+                (held[stage.name] if task.id in self.suspects else tasks).append(task)
+            for i, task in enumerate(tasks):
+                executor = executors[stage.name]
+                try:
+                    inflight[executor.submit(stage.func, task.payload)] = (stage, task, executor, False)
+                except BrokenProcessPool:
+                    # broke before its failed futures were collected; nothing here has run
+                    self._replace(executors, stage, executor, stage.workers)
+                    self.queue.release(tasks[i:])
+                    break
+
+        # suspects run one at a time, so a crash can only be the running one's
+        for stage in self.stages:
+            if held[stage.name] and stage.name not in alone:
+                executor = isolated[stage.name]
+                task = held[stage.name].popleft()
+                inflight[executor.submit(stage.func, task.payload)] = (stage, task, executor, True)
+
+
+    def _replace (self, executors: dict, stage: Stage, broken: ProcessPoolExecutor, workers: int):
+        """Swap a broken pool for a new one (once, however many of its futures report it)"""
+        if executors[stage.name] is broken:
+            executors[stage.name] = ProcessPoolExecutor(max_workers=workers)
+            broken.shutdown(wait=False)
+
+
+    def _log_report (self):
+        for name, counts in self.report().items():
+            log.info("%-8s pending=%d running=%d done=%d failed=%d rate=%.2f/s",
+                     name, counts['pending'], counts['running'], counts['done'],
+                     counts['failed'], counts['rate'])
+
+
+def main (argv: List[str] = None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--queue', default=config.work_queue_path, help='work queue database')
+    parser.add_argument('sources', nargs='*', help='files or (flat) directories to ingest')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+
+    queue = WorkQueue(args.queue)
+    files = []
+    for src in args.sources:
+        if os.path.isdir(src):
+            files.extend( os.path.join(src, _) for _ in sorted(os.listdir(src))
+                          if os.path.isfile(os.path.join(src, _)) )
+        else:
+            files.append(src)
+    files = [ os.path.abspath(_) for _ in files ]
+    added = queue.enqueue_many('ingest', [ (_, {'source': _}) for _ in files ])
+    log.info("queued %d new files for ingest", added)
+
+    Scheduler(queue).run()
+
+
+if __name__ == '__main__':
+    main()
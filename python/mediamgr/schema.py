@@ -6,6 +6,11 @@ collections = {
 }
 
 
+# collections written by mediamgr itself rather than through CollectionDocument
+# subclasses.  These are never recorded in the changelog.
+internal_collections = ['changelog']
+
+
 # these are created after the collections
 graphs = {
     'casting_graph': {
@@ -23,9 +28,31 @@ graphs = {
 }
 
 
-# these create separate persistent indexes for each property in the list
+# typed, indexed fields within media.metadata
+# these become properties of the metadata object in schema['media'] and each
+# gets a persistent index on [metadata.<field>, _key], which serves filtering
+# and key-range pagination on that one field (see mediamgr.aql.MediaQuery)
+# other metadata content (e.g. the raw ffprobe output) remains free-form
+# media documents saved before schema version 2 lack these fields until
+# they are re-saved with them
+media_metadata_fields = {
+    'md5':      'string',   # content hash, also the CAS object name
+    'type':     'string',   # 'image', 'video' or 'audio'
+    'duration': 'number',   # seconds; 0 for still images
+    'width':    'integer',  # pixels
+    'height':   'integer',  # pixels
+    'size':     'integer',  # bytes
+    'ingested': 'string'    # ISO 8601 UTC timestamp
+}
+
+
+# these create separate persistent indexes for each entry in the list
+# an entry is either a single property (dotted paths reach into objects) or
+# a list of properties for a compound index
 indexes = {
-    'faces': ['cast_id', 'media_id']
+    'changelog': ['seq'],
+    'faces': ['cast_id', 'media_id'],
+    'media': [ ['metadata.' + _, '_key'] for _ in media_metadata_fields ]
 }
 
 
@@ -64,14 +91,17 @@ schema['cast'] = {
 }
 
 schema['faces'] = {
-    'version': 1,
+    'version': 2,
     'schema': {
         'rule': {
             'type': 'object',
             'properties': {
                 'face_identifier':  {'type': 'string'},
                 'media_id':         {'type': 'string'},
-                'cast_id':          {'type': 'string'}
+                'cast_id':          {'type': 'string'},
+                'rect':             {'type': 'array'},      # [left, top, right, bottom] in source pixels
+                'confidence':       {'type': 'number'},     # detector score
+                'embedding':        {'type': 'array'}       # face descriptor
             },
             'required': ['face_identifier', 'media_id', 'cast_id']
         },
@@ -81,12 +111,15 @@ schema['faces'] = {
 }
 
 schema['media'] = {
-    'version': 1,
+    'version': 2,
     'schema': {
         'rule': {
             'type': 'object',
             'properties': {
-                'metadata': {'type': 'object'}
+                'metadata': {
+                    'type': 'object',
+                    'properties': { k: {'type': v} for k, v in media_metadata_fields.items() }
+                }
             },
             'required': ['metadata']
         },
@@ -128,4 +161,27 @@ schema['face_matches_face'] = {
         'level': 'moderate',
         'message': 'Schema Validation Failed.'
     }
-}
\ No newline at end of file
+}
+
+# one entry per insert/update/delete made through CollectionDocument
+# seq is allocated from the 'changelog_seq' counter in mmconfig and is strictly
+# increasing; consumers page through it by seq (see mediamgr.changes)
+schema['changelog'] = {
+    'version': 1,
+    'schema': {
+        'rule': {
+            'type': 'object',
+            'properties': {
+                'seq':          {'type': 'integer'},
+                'collection':   {'type': 'string'},
+                'doc_key':      {'type': 'string'},
+                'rev':          {'type': 'string'},
+                'op':           {'type': 'string', 'enum': ['insert', 'update', 'delete']},
+                'timestamp':    {'type': 'string'}
+            },
+            'required': ['seq', 'collection', 'doc_key', 'op', 'timestamp']
+        },
+        'level': 'moderate',
+        'message': 'Schema Validation Failed.'
+    }
+}
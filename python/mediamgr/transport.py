@@ -0,0 +1,180 @@
+"""HTTP transport for the ArangoDB client
+
+Builds the ArangoClient arguments used by mediamgr.connect() from the
+arango_* settings in mediamgr.config, and keeps running counters of request,
+retry and connection pool activity (see stats()).
+"""
+import mediamgr.config as config
+from arango.http import DeflateRequestCompression, HTTPClient
+from arango.response import Response
+import logging
+import threading
+from requests import Session
+from requests.adapters import HTTPAdapter
+from typing import MutableMapping, Optional, Tuple, Union
+from urllib3.util.retry import Retry
+
+
+log = logging.getLogger(__name__)
+
+# only these are retried after the request has been sent; python-arango sends
+# AQL queries as POST, so those are never replayed.  Connection errors are not
+# retried here at all: they go straight to python-arango's host resolver, which
+# fails over to the next coordinator
+IDEMPOTENT_METHODS = ['GET', 'HEAD', 'OPTIONS']
+
+_stats_lock = threading.Lock()
+_stats = {
+    'requests': 0,          # requests sent
+    'retries': 0,           # retry attempts made by urllib3
+    'in_flight': 0,         # requests currently waiting on a response
+    'peak_in_flight': 0,    # highest in_flight seen
+    'saturated': 0          # requests sent while every pooled connection to the host was busy
+}
+
+
+def stats () -> dict:
+    """Returns a copy of the transport counters, plus the configured pool size"""
+    with _stats_lock:
+        result = dict(_stats)
+    result['pool_maxsize'] = config.arango_pool_maxsize
+    return result
+
+
+def reset_stats ():
+    """Zero the transport counters (in_flight is left alone)"""
+    with _stats_lock:
+        for k in _stats:
+            if k != 'in_flight':
+                _stats[k] = 0
+
+
+class _CountingRetry (Retry):
+    """urllib3 Retry policy that records each retry in the transport stats"""
+
+    def increment (self, *args, **kwargs):
+        retry = super().increment(*args, **kwargs)    # raises once retries are exhausted
+        with _stats_lock:
+            _stats['retries'] += 1
+        return retry
+
+
+class PooledHTTPClient (HTTPClient):
+    """requests-based HTTP client with a tunable, instrumented connection pool
+
+    Connections are kept alive and reused per host.  When pool_block is set,
+    callers wait for a free connection instead of opening (and then
+    discarding) extra ones beyond pool_maxsize.
+    """
+
+    def __init__ (self, request_timeout: Union[int, float, None] = 60,
+                  pool_maxsize: int = 10, pool_block: bool = True,
+                  retry_attempts: int = 3, backoff_factor: float = 0.5):
+        """Instantiate the HTTP client
+
+        request_timeout --  seconds to wait for a connection and for each response
+        pool_maxsize    --  kept-alive connections per host
+        pool_block      --  wait for a free pooled connection rather than
+                            opening a throwaway one when the pool is exhausted
+        retry_attempts  --  retries for idempotent reads that time out or are
+                            answered with a retryable status
+        backoff_factor  --  exponential backoff base in seconds (0.5, 1, 2, ...)
+        """
+        self.request_timeout = request_timeout
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.retry_attempts = retry_attempts
+        self.backoff_factor = backoff_factor
+
+        self._in_flight = {}    # id(session) -> requests in flight on that host's pool
+
+
+    def create_session (self, host: str) -> Session:
+        retry = _CountingRetry(
+            total=self.retry_attempts,
+            connect=0,              # let the host resolver fail over instead
+            other=0,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=IDEMPOTENT_METHODS,
+            raise_on_status=False)
+        adapter = HTTPAdapter(
+            pool_connections=1,     # one session per host, so one pool each
+            pool_maxsize=self.pool_maxsize,
+            pool_block=self.pool_block,
+            max_retries=retry)
+
+        session = Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+
+    def send_request (self, session: Session, method: str, url: str,
+                      headers: Optional[MutableMapping[str, str]] = None,
+                      params: Optional[MutableMapping[str, str]] = None,
+                      data: Union[str, bytes, None] = None,
+                      auth: Optional[Tuple[str, str]] = None) -> Response:
+        with _stats_lock:
+            _stats['requests'] += 1
+            _stats['in_flight'] += 1
+            if _stats['in_flight'] > _stats['peak_in_flight']:
+                _stats['peak_in_flight'] = _stats['in_flight']
+            host_in_flight = self._in_flight[id(session)] = self._in_flight.get(id(session), 0) + 1
+            saturated = host_in_flight > self.pool_maxsize
+            if saturated:
+                _stats['saturated'] += 1
+
+        if saturated:
+            log.debug("connection pool saturated for %s (%d in flight, pool size %d)",
+                      url, host_in_flight, self.pool_maxsize)
+
+        try:
+            response = session.request(
+                method=method,
+                url=url,
+                params=params,
+                data=data,
+                headers=headers,
+                auth=auth,
+                timeout=self.request_timeout)
+        finally:
+            with _stats_lock:
+                _stats['in_flight'] -= 1
+                self._in_flight[id(session)] -= 1
+
+        return Response(
+            method=method,
+            url=response.url,
+            headers=response.headers,
+            status_code=response.status_code,
+            status_text=response.reason,
+            raw_body=response.text)
+
+
+def client_options () -> dict:
+    """Returns keyword arguments for arango.ArangoClient from mediamgr.config"""
+    hosts = config.arango_url
+    if isinstance(hosts, str):
+        hosts = [ _.strip() for _ in hosts.split(',') ]
+
+    options = {
+        'hosts': hosts,
+        'host_resolver': config.arango_host_resolver,
+        'resolver_max_tries': config.arango_resolver_max_tries,
+        'request_timeout': config.arango_request_timeout,
+        'http_client': PooledHTTPClient(
+            request_timeout=config.arango_request_timeout,
+            pool_maxsize=config.arango_pool_maxsize,
+            pool_block=config.arango_pool_block,
+            retry_attempts=config.arango_retry_attempts,
+            backoff_factor=config.arango_retry_backoff)
+    }
+
+    if config.arango_request_compression_threshold is not None:
+        options['request_compression'] = DeflateRequestCompression(
+            threshold=config.arango_request_compression_threshold)
+    if config.arango_response_compression:
+        options['response_compression'] = config.arango_response_compression
+
+    return options
@@ -0,0 +1,105 @@
+"""Compact read-only document views
+
+A view holds the fields of one document in __slots__ with no db handle,
+collection handle or validation, so iterating large result sets costs little
+more than the field values themselves.  One view class is generated per
+collection in mediamgr.schema (see view_types), with a slot for _id, _key,
+_rev, mm_seq and each property declared in the collection's schema.
+
+Fields outside the schema are not kept.  A view becomes a full, editable
+CollectionDocument via to_document(); saving that updates (merges into) the
+stored document, so the undeclared fields are left intact server side.
+"""
+from mediamgr.changes import SEQUENCE_FIELD
+from mediamgr.schema import schema
+from typing import Iterable, Iterator
+
+
+SYSTEM_FIELDS = ('_id', '_key', '_rev', SEQUENCE_FIELD)
+
+
+class DocumentView ():
+    """Base class for generated read-only view types"""
+
+    __slots__ = ()
+    collection_name = None
+    fields = ()
+
+    def __init__ (self, document: dict):
+        """Build a view from a document dict (no validation is performed)"""
+        for k in self.fields:
+            if k in document:
+                object.__setattr__(self, k, document[k])
+
+    def __getattr__ (self, name: str):
+        # only reached for declared fields missing from the source document
+        if name in self.fields:
+            return None
+        raise AttributeError(name)
+
+    def __setattr__ (self, name: str, value):
+        raise AttributeError("{} is read-only; use to_document() to edit".format(type(self).__name__))
+
+    def __delattr__ (self, name: str):
+        raise AttributeError("{} is read-only; use to_document() to edit".format(type(self).__name__))
+
+    def __eq__ (self, other) -> bool:
+        return type(self) == type(other) and self.to_dict() == other.to_dict()
+
+    def __repr__ (self):
+        return '{}({!r})'.format(type(self).__name__, self.to_dict())
+
+    def __reduce__ (self):
+        # generated classes are not importable by name, so rebuild via view_types
+        return (_rebuild, (self.collection_name, self.to_dict()))
+
+    def to_dict (self) -> dict:
+        """Returns the view's fields as a new dict (missing fields are omitted)"""
+        d = {}
+        for k in self.fields:
+            try:
+                d[k] = object.__getattribute__(self, k)
+            except AttributeError:
+                pass
+        return d
+
+    def to_document (self, dbconn):
+        """Returns an editable CollectionDocument subclass instance for this document
+
+        dbconn  --  db handle from mediamgr.connect()
+        """
+        from mediamgr.models import document_classes
+        doc = document_classes[self.collection_name](dbconn)
+        doc.setDocument(self.to_dict())
+        return doc
+
+
+def make_view_type (collection: str) -> type:
+    """Generate a slotted view class from a collection's schema"""
+    properties = schema[collection]['schema']['rule']['properties']
+    fields = SYSTEM_FIELDS + tuple( _ for _ in properties if _ not in SYSTEM_FIELDS )
+    name = ''.join( _.capitalize() for _ in collection.split('_') ) + 'View'
+    return type(name, (DocumentView,), {
+        '__slots__': fields,
+        'collection_name': collection,
+        'fields': fields
+    })
+
+
+# collection name -> view class
+view_types = { c: make_view_type(c) for c in schema }
+
+
+def _rebuild (collection: str, document: dict) -> DocumentView:
+    return view_types[collection](document)
+
+
+def iter_views (documents: Iterable[dict], collection: str) -> Iterator[DocumentView]:
+    """Wrap an iterable of raw documents (e.g. a cursor) as views
+
+    documents   --  iterable of dicts, such as an arango Cursor
+    collection  --  name of the collection the documents came from
+    """
+    view = view_types[collection]
+    for document in documents:
+        yield view(document)
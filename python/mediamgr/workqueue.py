@@ -0,0 +1,194 @@
+from mediamgr.localdb import sqlite_transaction
+import json
+import sqlite3
+import time
+from typing import Dict, Iterable, List, NamedTuple, Tuple
+
+
+class Task (NamedTuple):
+    """A unit of work claimed from a WorkQueue"""
+    id: int
+    stage: str
+    key: str
+    payload: dict
+    attempts: int
+
+
+class WorkQueue ():
+    """Durable task queue backed by a local SQLite database
+
+    Tasks are identified by (stage, key); enqueueing a task that already exists
+    for a stage is a no-op, so re-running a pipeline over the same inputs never
+    redoes completed work.  Completing a task and enqueueing its successors
+    happens in a single transaction, so a crash leaves every task either
+    finished (with its successors queued) or still pending.
+
+    Task states: pending -> running -> done | failed
+    """
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__ (self, path: str):
+        """Open (creating if needed) a work queue
+
+        path    --  filesystem path of the SQLite database
+                    ':memory:' gives a throwaway in-process queue
+        """
+        self.path = path
+        self.conn = sqlite3.connect(path, isolation_level=None, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS tasks (
+                id          INTEGER PRIMARY KEY AUTOINCREMENT,
+                stage       TEXT NOT NULL,
+                key         TEXT NOT NULL,
+                payload     TEXT NOT NULL,
+                state       TEXT NOT NULL DEFAULT 'pending',
+                attempts    INTEGER NOT NULL DEFAULT 0,
+                error       TEXT,
+                created     REAL NOT NULL,
+                updated     REAL NOT NULL,
+                UNIQUE (stage, key)
+            );
+            CREATE INDEX IF NOT EXISTS tasks_stage_state ON tasks (stage, state, id);
+        ''')
+
+
+    def close (self):
+        self.conn.close()
+
+
+    def _transaction (self):
+        """Context manager wrapping an immediate (write-locked) transaction"""
+        return sqlite_transaction(self.conn)
+
+
+    def _insert (self, stage: str, tasks: Iterable[Tuple[str, dict]]) -> int:
+        now = time.time()
+        cur = self.conn.executemany(
+            'INSERT OR IGNORE INTO tasks (stage, key, payload, created, updated) VALUES (?, ?, ?, ?, ?)',
+            [ (stage, key, json.dumps(payload), now, now) for key, payload in tasks ])
+        return cur.rowcount
+
+
+    def claim (self, stage: str, limit: int = 1) -> List[Task]:
+        """Claim up to limit pending tasks from a stage, oldest first
+
+        Claimed tasks are marked running until complete() or fail() is called
+        """
+        with self._transaction():
+            rows = self.conn.execute(
+                'SELECT id, stage, key, payload, attempts FROM tasks '
+                'WHERE stage = ? AND state = ? ORDER BY id LIMIT ?',
+                (stage, self.PENDING, limit)).fetchall()
+            self.conn.executemany(
+                'UPDATE tasks SET state = ?, attempts = attempts + 1, updated = ? WHERE id = ?',
+                [ (self.RUNNING, time.time(), _[0]) for _ in rows ])
+
+        return [ Task(id, stage, key, json.loads(payload), attempts + 1)
+                 for id, stage, key, payload, attempts in rows ]
+
+
+    def complete (self, task: Task, next_stage: str = None, outputs: Iterable[Tuple[str, dict]] = ()):
+        """Mark a task done and enqueue its successors atomically
+
+        task        --  Task returned by claim()
+        next_stage  --  stage to enqueue outputs on (None for terminal stages)
+        outputs     --  (key, payload) tuples for next_stage
+        """
+        with self._transaction():
+            self.conn.execute(
+                'UPDATE tasks SET state = ?, error = NULL, updated = ? WHERE id = ?',
+                (self.DONE, time.time(), task.id))
+            if next_stage is not None:
+                self._insert(next_stage, outputs)
+
+
+    def depth (self) -> Dict[str, Dict[str, int]]:
+        """Returns task counts by stage and state
+
+        e.g. {'probe': {'pending': 10, 'running': 4, 'done': 100, 'failed': 0}}
+        """
+        result = {}
+        for stage, state, count in self.conn.execute(
+                'SELECT stage, state, COUNT(*) FROM tasks GROUP BY stage, state'):
+            counts = result.setdefault(stage, dict.fromkeys(
+                (self.PENDING, self.RUNNING, self.DONE, self.FAILED), 0))
+            counts[state] = count
+        return result
+
+
+    def enqueue (self, stage: str, key: str, payload: dict) -> bool:
+        """Add a task to a stage
+
+        Returns False if a task with this key already exists for the stage
+        """
+        return self.enqueue_many(stage, [(key, payload)]) == 1
+
+
+    def enqueue_many (self, stage: str, tasks: Iterable[Tuple[str, dict]]) -> int:
+        """Add (key, payload) tasks to a stage, skipping keys already present
+
+        Returns the number of tasks actually added
+        """
+        with self._transaction():
+            return self._insert(stage, tasks)
+
+
+    def fail (self, task: Task, error: str, max_attempts: int = 3):
+        """Record a task failure
+
+        The task goes back to pending until it has been attempted max_attempts
+        times, after which it is left in the failed state for inspection
+        """
+        state = self.FAILED if task.attempts >= max_attempts else self.PENDING
+        with self._transaction():
+            self.conn.execute(
+                'UPDATE tasks SET state = ?, error = ?, updated = ? WHERE id = ?',
+                (state, error, time.time(), task.id))
+
+
+    def pending (self, stage: str) -> int:
+        """Returns the number of pending tasks in a stage"""
+        return self.conn.execute(
+            'SELECT COUNT(*) FROM tasks WHERE stage = ? AND state = ?',
+            (stage, self.PENDING)).fetchone()[0]
+
+
+    def recover (self) -> int:
+        """Return tasks left running by a crashed scheduler to pending
+
+        Only call this when no other scheduler is using the queue.
+        Returns the number of tasks recovered
+        """
+        with self._transaction():
+            return self.conn.execute(
+                'UPDATE tasks SET state = ?, updated = ? WHERE state = ?',
+                (self.PENDING, time.time(), self.RUNNING)).rowcount
+
+
+    def release (self, tasks: Iterable[Task]):
+        """Return claimed tasks to pending without counting the attempt
+
+        For tasks that were claimed but never got to run, e.g. because the
+        worker pool they were meant for broke first
+        """
+        with self._transaction():
+            self.conn.executemany(
+                'UPDATE tasks SET state = ?, attempts = attempts - 1, updated = ? WHERE id = ? AND state = ?',
+                [ (self.PENDING, time.time(), _.id, self.RUNNING) for _ in tasks ])
+
+
+    def retry_failed (self, stage: str = None) -> int:
+        """Move failed tasks (optionally only those in one stage) back to pending"""
+        query = 'UPDATE tasks SET state = ?, attempts = 0, updated = ? WHERE state = ?'
+        params = [self.PENDING, time.time(), self.FAILED]
+        if stage is not None:
+            query += ' AND stage = ?'
+            params.append(stage)
+        with self._transaction():
+            return self.conn.execute(query, params).rowcount
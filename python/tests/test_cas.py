@@ -0,0 +1,123 @@
+from mediamgr.cas import RateLimiter, Verifier, cross_reference, hash_file, main, objects, quarantine
+import mediamgr.models
+import errno
+import hashlib
+import os
+import shutil
+import time
+
+
+def put (cas, data: bytes, ext: str = '.jpg') -> str:
+    name = hashlib.md5(data).hexdigest() + ext
+    with open(os.path.join(cas, name), 'wb') as f:
+        f.write(data)
+    return name
+
+
+def test_verify(tmp_path):
+    cas = str(tmp_path / 'cas')
+    os.makedirs(cas)
+    good = [ put(cas, bytes([_]) * 1000) for _ in range(5) ]
+    bad = put(cas, b'original')
+    with open(os.path.join(cas, bad), 'wb') as f:
+        f.write(b'bit rot')
+    open(os.path.join(cas, 'not-an-object.txt'), 'w').close()
+
+    assert sorted(objects(cas)) == sorted(good + [bad])
+
+    ## verify flags mismatched content
+    v = Verifier(cas, str(tmp_path / 'state.sqlite'))
+    result = v.verify()
+    assert result['checked'] == 6
+    assert result['skipped'] == 0
+    assert result['corrupt'] == [bad]
+
+    ## repeat runs skip recently verified objects, but retry failures and changes
+    v.close()
+    v = Verifier(cas, str(tmp_path / 'state.sqlite'))
+    result = v.verify()
+    assert result['checked'] == 1
+    assert result['skipped'] == 5
+    with open(os.path.join(cas, good[0]), 'ab') as f:
+        f.write(b'truncated copy grew back')
+    result = v.verify()
+    assert result['checked'] == 2
+    assert sorted(result['corrupt']) == sorted([bad, good[0]])
+
+    ## expired verifications are rechecked
+    assert v.verify(recheck=0)['checked'] == 6
+
+    ## quarantine (recently changed objects stay put), forget_missing
+    q = str(tmp_path / 'quarantine')
+    assert quarantine(result['corrupt'], cas, q) == 0
+    assert quarantine(result['corrupt'], cas, q, grace=0) == 2
+    assert sorted(os.listdir(q)) == sorted([bad, good[0]])
+    result = v.verify()
+    assert result['corrupt'] == []
+    assert result['checked'] + result['skipped'] == 4
+
+
+def test_rate_limit(tmp_path):
+    path = str(tmp_path / 'blob')
+    with open(path, 'wb') as f:
+        f.write(b'x' * 300000)
+
+    limiter = RateLimiter(1000000, burst=100000)
+    start = time.monotonic()
+    assert hash_file(path, limiter, blocksize=50000) == hashlib.md5(b'x' * 300000).hexdigest()
+    # 300KB at 1MB/s with a 100KB burst takes at least ~0.2s
+    assert time.monotonic() - start >= 0.15
+
+
+def test_quarantine_cross_device(tmp_path, monkeypatch):
+    cas = str(tmp_path / 'cas')
+    os.makedirs(cas)
+    names = [ put(cas, bytes([_]) * 10) for _ in range(2) ]
+
+    # simulate a quarantine directory on another filesystem
+    def rename (src, dst):
+        raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+    monkeypatch.setattr(os, 'rename', rename)
+    monkeypatch.setattr(shutil, 'move', lambda src, dst: (shutil.copy2(src, dst), os.unlink(src)))
+
+    q = str(tmp_path / 'quarantine')
+    assert quarantine(names + ['missing.jpg'], cas, q, grace=0) == 2
+    assert sorted(os.listdir(q)) == sorted(names)
+    assert objects(cas) == {}
+
+
+class MediaRows ():
+    """Stands in for a db handle; aql.execute yields [_key, metadata.md5] rows"""
+
+    def __init__ (self, rows: list):
+        self.aql = self
+        self.rows = rows
+
+    def execute (self, query: str, **kwargs):
+        return iter(self.rows)
+
+
+def test_cross_reference(tmp_path, monkeypatch):
+    cas = str(tmp_path / 'cas')
+    os.makedirs(cas)
+    typed, keyed, stray, orphan = [ put(cas, bytes([_]) * 10) for _ in range(4) ]
+    md5 = lambda name: name.split('.')[0]
+
+    ## media without metadata.md5 are matched by _key
+    rows = [ ['m1', md5(typed)], [md5(keyed), None], ['gone', 'f' * 32] ]
+    refs = cross_reference(MediaRows(rows), cas, grace=0)
+    assert refs['orphans'] == sorted([stray, orphan])
+    assert refs['dangling'] == ['gone']
+    assert (refs['unhashed'], refs['unresolved']) == (1, 0)
+
+    ## a media document matching no object by _key blocks orphan quarantine
+    rows.append(['legacy-key', None])
+    assert cross_reference(MediaRows(rows), cas, grace=0)['unresolved'] == 1
+    monkeypatch.setattr(mediamgr.models, 'connect', lambda: MediaRows(rows))
+    q = str(tmp_path / 'quarantine')
+    main(['--cas', cas, '--state', str(tmp_path / 'state.sqlite'), '--grace', '0', '--quarantine', q])
+    assert sorted(objects(cas)) == sorted([typed, keyed, stray, orphan])
+
+    rows.pop()
+    main(['--cas', cas, '--state', str(tmp_path / 'state.sqlite'), '--grace', '0', '--quarantine', q])
+    assert sorted(os.listdir(q)) == sorted([stray, orphan])
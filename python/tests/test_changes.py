@@ -0,0 +1,57 @@
+import mediamgr.config
+from arango.exceptions import DocumentInsertError
+from mediamgr.changes import ChangeConsumer, SEQUENCE_FIELD, next_sequence
+from mediamgr.models import *
+import pytest
+import uuid
+
+
+def test_changes():
+    # uses the pytest db, but does not depend on its contents
+    mediamgr.config.arango_dbname = 'mediamgr-pytest'
+    db = connect()
+
+    ## next_sequence
+    first = next_sequence(db, count=5)
+    assert next_sequence(db) == first + 5
+
+    # fresh consumer, skip everything already in the log
+    consumer = ChangeConsumer(db, 'pytest_{}'.format(uuid.uuid4().hex), ['cast'])
+    assert consumer.checkpoint() == 0
+    consumer.commit(first + 5)
+    assert consumer.checkpoint() == first + 5
+
+    ## save (insert, update), delete
+    c = CastDocument(db)
+    c.new()
+    c.save()
+    insert_seq = c.document[SEQUENCE_FIELD]
+    c.document['name'] = 'changes'
+    c.save()
+    assert c.document[SEQUENCE_FIELD] > insert_seq
+    key = c._key
+    c.delete()
+    assert c.document is None
+
+    ## save_many
+    docs = [ {'name': 'bulk{}'.format(i), 'refs': []} for i in range(3) ]
+    c.save_many(docs)
+    assert all( '_rev' in _ for _ in docs )
+    seqs = [ _[SEQUENCE_FIELD] for _ in docs ]
+    assert seqs == sorted(seqs)
+
+    ## changes / batches
+    entries = [ _ for batch in consumer.batches(batch_size=2) for _ in batch ]
+    assert [ _['op'] for _ in entries ] == ['insert', 'update', 'delete', 'insert', 'insert', 'insert']
+    assert entries[0]['doc_key'] == key
+    assert entries[2]['document'] is None
+    assert entries[-1]['document']['name'] == 'bulk2'
+    assert consumer.checkpoint() == entries[-1]['seq']
+    assert consumer.changes() == []
+
+    ## a rejected tracked batch writes nothing and leaves no gap in the seqs
+    last = entries[-1]['seq']
+    with pytest.raises(DocumentInsertError):
+        c.save_many([ {'name': 'dup', 'refs': []}, {'_key': docs[0]['_key'], 'name': 'dup', 'refs': []} ])
+    assert consumer.changes() == []
+    assert next_sequence(db) == last + 1
@@ -0,0 +1,65 @@
+from mediamgr.chipstore import ChipStore
+import numpy as np
+import pytest
+
+
+def chip (n: int) -> np.ndarray:
+    return np.full((8, 8, 3), n, dtype=np.uint8)
+
+
+def test_chipstore(tmp_path):
+    path = str(tmp_path / 'chips')
+    # tiny packs so the batches below roll over into several files
+    store = ChipStore(path, size=8, pack_bytes=4 * 192)
+    assert store.stride == 192
+
+    ## put_many (duplicates are skipped, within a batch too)
+    assert store.put_many([ ('f{}'.format(_), chip(_)) for _ in range(6) ] + [('f5', chip(0))]) == 6
+    assert (store.get('f5') == 5).all()
+    assert store.put_many([ ('f0', chip(0)), ('f6', chip(6)) ]) == 1
+    assert len(store) == 7
+    with pytest.raises(ValueError):
+        store.put_many([('bad', np.zeros((4, 4, 3), dtype=np.uint8))])
+
+    ## get, get_many (zero-copy, read-only)
+    view = store.get('f3')
+    assert view.shape == (8, 8, 3)
+    assert (view == 3).all()
+    assert not view.flags.writeable
+    assert [ None if _ is None else int(_[0, 0, 0]) for _ in store.get_many(['f6', 'nope', 'f1']) ] == [6, None, 1]
+    with pytest.raises(KeyError):
+        store.get('nope')
+
+    ## reopen, size mismatch
+    store.close()
+    store = ChipStore(path, size=8, pack_bytes=4 * 192)
+    assert (store.get('f6') == 6).all()
+    with pytest.raises(ValueError):
+        ChipStore(path, size=16)
+
+    ## discard, compact
+    assert store.discard(['f0', 'f1']) == 2
+    assert 'f0' not in store
+    before = store.stats()
+    assert sum( _['live'] for _ in before.values() ) == 5
+    # chips written within the grace period survive a stale live set
+    assert store.compact(live=['f2', 'f3', 'f4', 'f6'], min_garbage=2) == 0
+    assert 'f5' in store
+    removed = store.compact(live=['f2', 'f3', 'f4', 'f6'], grace=0)
+    assert removed >= 1
+    after = store.stats()
+    assert sum( _['live'] for _ in after.values() ) == 4
+    assert sum( _['slots'] for _ in after.values() ) < sum( _['slots'] for _ in before.values() )
+    for n in (2, 3, 4, 6):
+        assert (store.get('f{}'.format(n)) == n).all()
+    # views taken before compaction are still usable
+    assert (view == 3).all()
+
+    ## pack numbers are never reused, so another instance never reads a stale map
+    other = ChipStore(path, size=8, pack_bytes=4 * 192)
+    assert (other.get('f2') == 2).all()
+    assert store.compact(live=[], grace=0) >= 1
+    assert len(store) == 0
+    assert store.put_many([('g0', chip(7))]) == 1
+    assert (other.get('g0') == 7).all()
+    assert 'f2' not in other
@@ -193,3 +193,44 @@ def test_e2e():
     faces = sorted([ _['_key'] for _ in m.get_faces() ])
     assert len(faces) == 1
     assert faces[0] == '3030'
+
+
+    # read-only views
+
+    ## find_views, to_document
+    faces = sorted([ _._key for _ in f.find_views({'cast_id': 'cast/1010'}) ])
+    assert faces == ['3020', '3030']
+    v = next(c.find_views({'name': 'foo'}))
+    assert v._key == '1000'
+    c = v.to_document(db)
+    assert isinstance(c, CastDocument)
+    assert c._rev == v._rev
+    c.document['name'] = 'bar'
+    c.save()
+
+    ## get_many, exists_many (small chunks to exercise the parallel path)
+    keys = ['3030', 'nope', 'faces/3000', '3010']
+    docs = f.get_many(keys, chunk_size=1)
+    assert [ None if _ is None else _['_key'] for _ in docs ] == ['3030', None, '3000', '3010']
+    assert f.exists_many(keys, chunk_size=2) == [True, False, True, True]
+    assert f.get_many(['cast/3000']) == [None]
+    assert f.exists_many(['cast/3000', 'faces/3000']) == [False, True]
+    assert f.get_many([]) == []
+
+    ## query (key-range paging over typed metadata)
+    for i, duration in enumerate([30.0, 10.0, 20.0, 10.0, 40.0]):
+        m.new({'_key': '40{}0'.format(i), 'metadata': {'type': 'video', 'duration': duration}})
+        m.save()
+    m.new({'_key': '4050', 'metadata': {'type': 'image', 'duration': 0.0}})
+    m.save()
+
+    q = m.query(page_size=2).where('type', '==', 'video').where('duration', '>=', 10).order_by('duration')
+    docs, after = q.page()
+    assert [ _['_key'] for _ in docs ] == ['4010', '4030']
+    assert after == (10.0, '4030')
+    docs, after = q.page(after)
+    assert [ _['_key'] for _ in docs ] == ['4020', '4000']
+    assert [ _['_key'] for _ in q ] == ['4010', '4030', '4020', '4000', '4040']
+    assert [ _['_key'] for _ in m.query().where('type', 'in', ['image']) ] == ['4050']
+    with pytest.raises(ValueError):
+        m.query().where('probe', '==', {})
@@ -0,0 +1,22 @@
+from mediamgr.pipeline import media_metadata
+
+
+def test_media_metadata():
+    cover = {'codec_type': 'video', 'width': 500, 'height': 500, 'disposition': {'attached_pic': 1}}
+    audio = {'codec_type': 'audio', 'disposition': {'attached_pic': 0}}
+
+    ## embedded cover art does not make an audio file a video
+    m = media_metadata({'format': {'format_name': 'mp3', 'duration': '215.3', 'size': '5000000'},
+                        'streams': [audio, cover]})
+    assert m == {'type': 'audio', 'duration': 215.3, 'size': 5000000}
+
+    ## a real video stream does
+    video = {'codec_type': 'video', 'width': 1920, 'height': 1080, 'disposition': {'attached_pic': 0}}
+    m = media_metadata({'format': {'format_name': 'mov,mp4,m4a,3gp,3g2,mj2', 'duration': '60', 'size': '100'},
+                        'streams': [video, audio]})
+    assert (m['type'], m['width'], m['height']) == ('video', 1920, 1080)
+
+    ## stills
+    m = media_metadata({'format': {'format_name': 'jpeg_pipe', 'size': '2048'},
+                        'streams': [{'codec_type': 'video', 'width': 640, 'height': 480}]})
+    assert m == {'type': 'image', 'duration': 0.0, 'size': 2048, 'width': 640, 'height': 480}
@@ -0,0 +1,102 @@
+import mediamgr.config
+import mediamgr.transport as transport
+from arango import ArangoClient
+from arango.http import DeflateRequestCompression
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import socket
+import threading
+import time
+
+
+class Flaky (BaseHTTPRequestHandler):
+    # fail the first GET with 503, then succeed; POSTs always fail
+    calls = 0
+
+    def do_GET (self):
+        Flaky.calls += 1
+        self.send_response(503 if Flaky.calls == 1 else 200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+    def do_POST (self):
+        Flaky.calls += 1
+        self.send_response(503)
+        self.end_headers()
+
+    def log_message (self, *args):
+        pass
+
+
+class Version (BaseHTTPRequestHandler):
+    def do_GET (self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(b'{"server": "arango", "version": "3.11.0"}')
+
+    def log_message (self, *args):
+        pass
+
+
+def test_client_options(monkeypatch):
+    monkeypatch.setattr(mediamgr.config, 'arango_url', 'http://a:8529, http://b:8529')
+    monkeypatch.setattr(mediamgr.config, 'arango_host_resolver', 'roundrobin')
+    monkeypatch.setattr(mediamgr.config, 'arango_request_compression_threshold', 1024)
+    monkeypatch.setattr(mediamgr.config, 'arango_response_compression', None)
+
+    options = transport.client_options()
+    assert options['hosts'] == ['http://a:8529', 'http://b:8529']
+    assert options['host_resolver'] == 'roundrobin'
+    assert isinstance(options['request_compression'], DeflateRequestCompression)
+    assert 'response_compression' not in options
+    assert options['http_client'].pool_maxsize == mediamgr.config.arango_pool_maxsize
+
+
+def test_retries():
+    server = HTTPServer(('127.0.0.1', 0), Flaky)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:{}/'.format(server.server_port)
+
+    client = transport.PooledHTTPClient(pool_maxsize=2, retry_attempts=2, backoff_factor=0)
+    session = client.create_session(url)
+    transport.reset_stats()
+
+    ## idempotent reads are retried
+    assert client.send_request(session, 'get', url).status_code == 200
+    assert Flaky.calls == 2
+
+    ## writes are not
+    assert client.send_request(session, 'post', url, data='{}').status_code == 503
+    assert Flaky.calls == 3
+
+    stats = transport.stats()
+    assert stats['requests'] == 2
+    assert stats['retries'] == 1
+    assert stats['in_flight'] == 0
+    assert stats['saturated'] == 0
+    server.shutdown()
+
+
+def test_failover():
+    server = HTTPServer(('127.0.0.1', 0), Version)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    live = 'http://127.0.0.1:{}'.format(server.server_port)
+    # a port nothing listens on
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        dead = 'http://127.0.0.1:{}'.format(s.getsockname()[1])
+
+    client = ArangoClient(
+        hosts=[dead, live],
+        host_resolver='fallback',
+        http_client=transport.PooledHTTPClient(retry_attempts=3, backoff_factor=0.5))
+    db = client.db('_system', verify=False)
+    transport.reset_stats()
+
+    ## connection errors go straight to the next host, without retries or backoff
+    start = time.monotonic()
+    assert db.version() == '3.11.0'
+    assert time.monotonic() - start < 0.5
+    assert transport.stats()['retries'] == 0
+    server.shutdown()
@@ -0,0 +1,42 @@
+from mediamgr.views import iter_views, view_types
+import pickle
+import pytest
+
+
+def test_views():
+    FacesView = view_types['faces']
+    assert FacesView.__name__ == 'FacesView'
+    assert view_types['face_matches_face'].__name__ == 'FaceMatchesFaceView'
+    assert set(['_id', '_key', '_rev', 'mm_seq', 'face_identifier', 'media_id', 'cast_id']) <= set(FacesView.fields)
+
+    doc = {'_id': 'faces/1', '_key': '1', 'face_identifier': 'abc_0',
+           'media_id': 'media/abc', 'cast_id': '', 'undeclared': 'dropped'}
+    v = FacesView(doc)
+
+    ## slotted, no per-instance dict
+    assert not hasattr(v, '__dict__')
+
+    ## field access, missing declared fields read as None
+    assert v._key == '1'
+    assert v.face_identifier == 'abc_0'
+    assert v.embedding is None
+    with pytest.raises(AttributeError):
+        v.undeclared
+
+    ## read-only
+    with pytest.raises(AttributeError):
+        v.cast_id = 'cast/1'
+    with pytest.raises(AttributeError):
+        del v.cast_id
+
+    ## to_dict omits missing fields and anything outside the schema
+    d = v.to_dict()
+    del doc['undeclared']
+    assert d == doc
+
+    ## equality, pickling
+    assert pickle.loads(pickle.dumps(v)) == v
+
+    ## iter_views
+    keys = [ _._key for _ in iter_views(({'_key': str(_)} for _ in range(3)), 'media') ]
+    assert keys == ['0', '1', '2']
@@ -0,0 +1,103 @@
+from mediamgr.pipeline import Scheduler, Stage
+from mediamgr.workqueue import WorkQueue
+import os
+import time
+
+
+def double (payload: dict) -> list:
+    return [(str(payload['n']), {'n': payload['n'] * 2})]
+
+
+def explode (payload: dict) -> list:
+    if payload['n'] % 4 == 0:
+        raise RuntimeError('boom')
+    return []
+
+
+def crash (payload: dict) -> list:
+    if payload['n'] == 0:
+        os._exit(1)     # like a segfault in native code, takes the worker down
+    time.sleep(0.05)    # keep the other tasks on the pool when it breaks
+    return []
+
+
+def test_workqueue(tmp_path):
+    path = str(tmp_path / 'queue.sqlite')
+    q = WorkQueue(path)
+
+    ## enqueue, enqueue_many (duplicate keys are ignored)
+    assert q.enqueue('a', '1', {'n': 1})
+    assert not q.enqueue('a', '1', {'n': 1})
+    assert q.enqueue_many('a', [ (str(_), {'n': _}) for _ in range(1, 4) ]) == 2
+    assert q.pending('a') == 3
+
+    ## claim
+    tasks = q.claim('a', 2)
+    assert [ _.key for _ in tasks ] == ['1', '2']
+    assert all( _.attempts == 1 for _ in tasks )
+    assert q.depth()['a']['running'] == 2
+
+    ## complete (successors are queued with it)
+    q.complete(tasks[0], 'b', [('x', {'n': 10})])
+    assert q.pending('b') == 1
+
+    ## fail (retry, then park)
+    q.fail(tasks[1], 'err', max_attempts=2)
+    assert q.pending('a') == 2
+    t = [ _ for _ in q.claim('a', 2) if _.key == '2' ][0]
+    assert t.attempts == 2
+    q.fail(t, 'err', max_attempts=2)
+    assert q.depth()['a']['failed'] == 1
+
+    ## recover (simulated crash with tasks still running)
+    q.close()
+    q = WorkQueue(path)
+    assert q.depth()['a']['running'] == 1
+    assert q.recover() == 1
+    assert q.pending('a') == 1
+
+    ## retry_failed
+    assert q.retry_failed('a') == 1
+    assert q.pending('a') == 2
+
+    ## release (claimed but never run, so the attempt is not counted)
+    tasks = q.claim('a', 2)
+    q.release(tasks)
+    assert q.pending('a') == 2
+    assert [ _.attempts for _ in q.claim('a', 2) ] == [ _.attempts for _ in tasks ]
+
+
+def test_scheduler(tmp_path):
+    q = WorkQueue(str(tmp_path / 'queue.sqlite'))
+    q.enqueue_many('double', [ (str(_), {'n': _}) for _ in range(20) ])
+
+    stages = [
+        Stage('double', double, workers=2, next='explode', max_pending=5),
+        Stage('explode', explode, workers=2, max_attempts=2)
+    ]
+    s = Scheduler(q, stages)
+    s.run(poll=0.05)
+
+    report = s.report()
+    assert report['double']['done'] == 20
+    assert report['explode']['done'] == 10
+    assert report['explode']['failed'] == 10
+    assert report['double']['rate'] > 0
+
+    # completed work is not redone on a second run
+    q.enqueue_many('double', [ (str(_), {'n': _}) for _ in range(20) ])
+    s = Scheduler(q, stages)
+    s.run(poll=0.05)
+    assert s.completed['double'] == 0
+
+
+def test_scheduler_crash(tmp_path):
+    q = WorkQueue(str(tmp_path / 'queue.sqlite'))
+    q.enqueue_many('crash', [ (str(_), {'n': _}) for _ in range(8) ])
+
+    # only the task that kills its worker is charged for it
+    s = Scheduler(q, [Stage('crash', crash, workers=2, max_attempts=2)])
+    s.run(poll=0.05)
+    assert q.depth()['crash'] == {'pending': 0, 'running': 0, 'done': 7, 'failed': 1}
+    assert [ _[0] for _ in q.conn.execute("SELECT key FROM tasks WHERE state = 'failed'") ] == ['0']
+    assert all( _[0] == 1 for _ in q.conn.execute("SELECT attempts FROM tasks WHERE state = 'done'") )